@@ -0,0 +1,230 @@
+"""
+Array-backed belief states for POMDPs.
+A belief state is usually handled as a dictionary of {state: probability}
+pairs, which makes every filter step a loop over all states in Python.
+Here the POMDP is compiled once (see POMDP.compile) and a belief is a
+contiguous float64 vector indexed by state number, so one filter step is a
+single sparse matrix-vector product plus normalization.
+"""
+from collections import OrderedDict
+import hashlib
+import numpy as np
+import instrumentation
+
+
+class BeliefModel:
+    """Filtering on a CompiledPOMDP. The transition model is the sparse
+    CSR matrix of the compiled model and the sensor model its dense
+    (evidences, states) matrix. Terminal states are absorbing, so belief
+    mass that reaches a terminal stays there."""
+
+    def __init__(self, model):
+        self.model = model
+        self.actlist = model.actlist
+        self.evidence_values = model.evidence_values
+        self.rewards = model.rewards
+        self.terminal_mask = model.terminal_mask
+
+    @property
+    def states(self):
+        return self.model.states
+
+    @property
+    def index(self):
+        return self.model.index
+
+    def to_array(self, belief_state):
+        """Convert a {state: probability} mapping into a belief vector."""
+
+        b = np.zeros(self.model.n_states, dtype=np.float64)
+        for s, p in belief_state.items():
+            b[self.index[s]] = p
+        return b
+
+    def to_belief_state(self, b):
+        """Convert a belief vector back into a {state: probability} mapping."""
+
+        return dict(zip(self.states, b.tolist()))
+
+    def predict(self, b, action):
+        """The predicted belief after doing action, before any evidence:
+        b'(s') = sum_s P(s'|s, a) b(s)."""
+
+        return self.model.propagate(b, action)
+
+    def update(self, b, action, evidence):
+        """The filter algorithm: predict with the transition model, weight by
+        the sensor model for the observed evidence and normalize. Returns a
+        zero vector if the evidence is impossible under b and action."""
+
+        instrumentation.count('belief_updates', filter='exact')
+        b1 = self.predict(b, action) * self.model.evidence_likelihood(evidence)
+        total = b1.sum()
+        if total > 0:
+            b1 /= total
+        return b1
+
+    def update_batch(self, B, actions, evidences, indices=False):
+        """Filter many beliefs at once. B is an (N, states) array of belief
+        vectors, actions a sequence of N actions and evidences a sequence of
+        N evidence values, as for update. With indices=True they are instead
+        arrays of indices into actlist and evidence_values, which is what
+        vectorized simulators produce. Returns the (N, states) array of
+        updated beliefs and the N expected rewards of those beliefs. Rows
+        whose evidence is impossible come back as zero vectors."""
+
+        B = np.asarray(B, dtype=np.float64)
+        instrumentation.count('belief_updates', len(B), filter='batch')
+        if indices:
+            actions, evidences = np.asarray(actions), np.asarray(evidences)
+        else:
+            actions = np.array([self.model.action_index[a] for a in actions], dtype=np.int64)
+            evidences = np.array([self.model.evidence_index[e] for e in evidences], dtype=np.int64)
+        predecessors, probabilities = self.model.predecessor_table()
+        B1 = np.zeros_like(B)
+        for a in np.unique(actions):
+            rows = np.nonzero(actions == a)[0]
+            sub = B[rows]
+            predicted = np.zeros_like(sub)
+            for k in range(predecessors.shape[2]):
+                predicted += sub[:, predecessors[a, :, k]] * probabilities[a, :, k]
+            B1[rows] = predicted
+        B1 += B * self.terminal_mask
+
+        B1 *= self.model.sensor[evidences]
+        totals = B1.sum(axis=1, keepdims=True)
+        np.divide(B1, totals, out=B1, where=totals > 0)
+        return B1, B1 @ self.rewards
+
+    def evidence_probability(self, b, action, evidence):
+        """P(e | b, a), the probability of observing evidence after doing
+        action in belief state b."""
+
+        return float(self.predict(b, action) @ self.model.evidence_likelihood(evidence))
+
+    def reward(self, b):
+        """Expected reward of a belief vector."""
+
+        return float(self.rewards @ b)
+
+    def terminal_probability(self, b):
+        """Probability mass of b on terminal states."""
+
+        return float(b[self.terminal_mask].sum())
+
+
+class BeliefCache:
+    """A bounded LRU cache of results computed from a belief vector, such
+    as the updated belief after an action and evidence. Keys are a hash of
+    the belief rounded to quantum plus any other arguments, so beliefs that
+    differ by float noise share an entry. Holds at most capacity entries;
+    the least recently used one is dropped first. name tags the memo hit
+    and miss counts of the instrumentation."""
+
+    def __init__(self, capacity=4096, quantum=1e-9, name='belief_cache'):
+        self.capacity = capacity
+        self.quantum = quantum
+        self.name = name
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+
+    def key(self, b, *args):
+        quantized = np.round(np.asarray(b) / self.quantum).astype(np.int64)
+        return (hashlib.blake2b(quantized.tobytes(), digest_size=16).digest(),) + args
+
+    def get(self, key, default=None):
+        """The value stored under key, or default. Counts a hit or a miss."""
+
+        try:
+            self.entries.move_to_end(key)
+            value = self.entries[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            instrumentation.count('memo_hits', memo=self.name)
+            return value
+        self.misses += 1
+        instrumentation.count('memo_misses', memo=self.name)
+        return default
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            try:
+                self.entries.popitem(last=False)
+            except KeyError:
+                break
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'size': len(self.entries), 'capacity': self.capacity}
+
+
+class SparseBelief(dict):
+    """A belief state that only stores its support: a {state: probability}
+    mapping in which missing states have probability 0. After every filter
+    step, states with a probability below epsilon are dropped and the rest
+    is renormalized, so a step only touches the successors of the support
+    and costs O(support * branching) whatever the number of states."""
+
+    def __init__(self, probabilities=(), epsilon=1e-9):
+        dict.__init__(self, probabilities)
+        self.epsilon = epsilon
+        self.prune()
+
+    def __missing__(self, state):
+        return 0.0
+
+    def prune(self):
+        """Drop states below epsilon and renormalize."""
+
+        for s in [s for s, p in self.items() if p < self.epsilon]:
+            del self[s]
+        total = sum(self.values())
+        if total > 0:
+            for s in self:
+                self[s] /= total
+
+    def filtered(self, pomdp, action, evidence):
+        """The filter algorithm on the support, with the transition and sensor
+        tables of pomdp. Terminal states are absorbing. Returns a new
+        SparseBelief, which is empty if the evidence is impossible. (Named
+        so as not to shadow dict.update.)"""
+
+        instrumentation.count('belief_updates', filter='sparse')
+        terminals = set(pomdp.terminals or [])
+        predicted = {}
+        for s, p in self.items():
+            if s in terminals:
+                predicted[s] = predicted.get(s, 0) + p
+                continue
+            for (q, s1) in pomdp.transitions[s][action]:
+                predicted[s1] = predicted.get(s1, 0) + p * q
+
+        new_belief = {}
+        for s1, p in predicted.items():
+            likelihood = sum(q for (q, e) in pomdp.evidences[s1] if e == evidence)
+            if p * likelihood > 0:
+                new_belief[s1] = p * likelihood
+        return SparseBelief(new_belief, self.epsilon)
+
+    def reward(self, pomdp):
+        """Expected reward, summed over the support."""
+
+        return sum(pomdp.R(s) * p for s, p in self.items())
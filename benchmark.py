@@ -0,0 +1,182 @@
+"""
+Benchmark of the MDP and POMDP solvers on generated grids.
+For every grid size and seed, runs the solvers and records wall time, peak
+traced memory, iterations to convergence and the mean discounted return of
+the resulting policy over simulated episodes, then writes everything as
+JSON. Iterations are read from the instrumentation of the solvers; the
+expectimax planner reports the belief nodes it expanded instead. Run e.g.
+
+    python benchmark.py --sizes 4 8 16 --seeds 0 1 2 --episodes 1000 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+
+import grid_pomdp
+import instrumentation
+import mdp
+from belief import BeliefModel
+from expectimax import ExpectimaxPlanner
+from grid_generator import generate_grid, to_nested_list
+from grid_mdp import GridMDP
+from grid_pomdp import GridPOMDP
+from simulator import Simulator, policy_array
+
+
+def make_grid(size, seed, kind='random', obstacle_density=0.1):
+    """A generated size x size grid as the nested list GridMDP takes, with
+    a +1 goal and a -1 pit, and its terminals."""
+
+    rewards, terminals = generate_grid(size, size, kind, obstacle_density, seed=seed)
+    return to_nested_list(rewards), terminals
+
+
+def measure(solve, memory=True):
+    """Run solve() and return (result, seconds, peak traced bytes, collector)
+    where collector is the instrumentation.MemoryCollector of the timed run.
+    Time and memory come from separate runs, since tracing slows Python
+    down."""
+
+    with instrumentation.instrumented(instrumentation.MemoryCollector()) as collector:
+        start = time.perf_counter()
+        result = solve()
+        seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        solve()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak, collector
+
+
+def belief_returns(model, choose_actions, n_episodes, rng, horizon):
+    """Discounted returns of a belief-based policy over simulated episodes
+    with real evidence. choose_actions maps an (N, states) belief array to
+    N action indices."""
+
+    simulator, beliefs = Simulator(model), BeliefModel(model)
+    initial = np.where(model.terminal_mask, 0.0, 1.0)
+    initial /= initial.sum()
+    states = simulator.reset(n_episodes, rng, initial)
+    B = np.tile(initial, (n_episodes, 1))
+    returns = model.rewards[states].copy()
+    done = model.terminal_mask[states].copy()
+    discount = 1.0
+    for _ in range(horizon):
+        if done.all():
+            break
+        discount *= model.gamma
+        actions = choose_actions(B)
+        states, rewards, terminal, evidence = simulator.step(states, actions, rng)
+        returns += np.where(done, 0.0, discount * rewards)
+        done |= terminal
+        B, _ = beliefs.update_batch(B, actions, evidence, indices=True)
+    return returns
+
+
+def benchmark_mdp(size, seed, kind, episodes, horizon, memory):
+    results = []
+    grid, terminals = make_grid(size, seed, kind)
+    environment = GridMDP([row[:] for row in grid], terminals=terminals)
+    model = environment.compile()
+    n = len(environment.states)
+
+    # iterations are counted by the series each solver observes once per sweep
+    solvers = [
+        ('value_iteration', lambda: mdp.value_iteration(environment, .001), 'residual'),
+        ('value_iteration_vectorized', lambda: mdp.value_iteration_vectorized(model, .001), 'residual'),
+        ('policy_iteration', lambda: mdp.policy_iteration(environment), 'policy_changes'),
+        ('policy_iteration_vectorized', lambda: mdp.policy_iteration_vectorized(model), 'policy_changes'),
+    ]
+    for name, solve, series in solvers:
+        result, seconds, peak, collector = measure(solve, memory)
+        pi = result if name.startswith('policy') else mdp.best_policy(environment, result)
+        returns = Simulator(model).evaluate_policy(policy_array(model, pi), episodes,
+                                                   np.random.default_rng(seed), horizon)
+        results.append(dict(solver=name, states=n, seconds=seconds, peak_memory_bytes=peak,
+                            iterations=len(collector.values[series]), mean_return=float(returns.mean())))
+    return results
+
+
+def benchmark_pomdp(size, seed, kind, episodes, horizon, memory, depth):
+    results = []
+    grid, terminals = make_grid(size, seed, kind)
+    with contextlib.redirect_stdout(io.StringIO()):
+        environment = GridPOMDP([row[:] for row in grid], terminals=terminals, init=(0, 0))
+    model = environment.compile()
+    n = len(environment.states)
+
+    # the DDN planner: expectimax over belief states. It has no iterations;
+    # expansions counts the belief nodes it evaluated, memo hits excluded
+    def run_ddn():
+        planner = ExpectimaxPlanner(BeliefModel(model), depth)
+
+        def plan(B):
+            actions = [planner.plan(b)[0] for b in B]
+            return np.array([model.action_index.get(a, 0) for a in actions])
+
+        returns = belief_returns(model, plan, episodes, np.random.default_rng(seed), horizon)
+        return returns, planner.transposition_table.misses
+
+    (returns, expansions), seconds, peak, _ = measure(run_ddn, memory)
+    results.append(dict(solver='ddn_expectimax', states=n, depth=depth, seconds=seconds,
+                        peak_memory_bytes=peak, iterations=None, expansions=expansions,
+                        mean_return=float(returns.mean())))
+
+    # point-based value iteration
+    solve = lambda: grid_pomdp.point_based_value_iteration(environment, n_beliefs=50, seed=seed)
+    policy, seconds, peak, collector = measure(solve, memory)
+    returns = belief_returns(model, policy.best_actions, episodes, np.random.default_rng(seed), horizon)
+    results.append(dict(solver='point_based_value_iteration', states=n, seconds=seconds,
+                        peak_memory_bytes=peak, iterations=len(collector.values['residual']),
+                        mean_return=float(returns.mean())))
+
+    # exact alpha-vector enumeration, which only handles two-state models
+    def run_exact():
+        try:
+            grid_pomdp.pomdp_value_iteration(environment)
+        except Exception as exception:
+            return '%s: %s' % (type(exception).__name__, exception)
+
+    error, seconds, peak, collector = measure(run_exact, memory)
+    results.append(dict(solver='pomdp_value_iteration', states=n, seconds=seconds, peak_memory_bytes=peak,
+                        iterations=len(collector.values['residual']), mean_return=None, error=error))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2])
+    parser.add_argument('--kind', choices=['random', 'maze', 'rooms'], default='random')
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--pomdp-episodes', type=int, default=20)
+    parser.add_argument('--horizon', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=2, help='expectimax depth of the DDN planner')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced memory runs')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        for seed in args.seeds:
+            for result in benchmark_mdp(size, seed, args.kind, args.episodes, args.horizon, not args.no_memory) + \
+                    benchmark_pomdp(size, seed, args.kind, args.pomdp_episodes, args.horizon, not args.no_memory, args.depth):
+                result.update(size=size, seed=seed)
+                results.append(result)
+                print('%-30s size %4d seed %3d  %10.4f s' % (result['solver'], size, seed, result['seconds']))
+
+    report = dict(config=vars(args), python=platform.python_version(), numpy=np.__version__,
+                  machine=platform.machine(), results=results)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
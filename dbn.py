@@ -0,0 +1,277 @@
+"""
+Factored dynamic decision networks.
+DynamicDecisionNetwork treats the world as one state variable, so its
+transition model is a table over pairs of joint states. Here the state is
+split into state variables, each with a conditional probability table
+P(X_t | parents_{t-1}, action) over a few variables of the previous slice,
+plus evidence variables P(E_t | parents_t) and additive utility nodes
+U(parents_t). The model is never multiplied out: a filter step contracts
+the belief with the per-variable tables by variable elimination (np.einsum
+with an optimized contraction order), so its cost follows the sizes of
+the factors instead of the square of the number of joint states. [Section
+15.5 and 17.4]
+
+The belief itself is an exact joint distribution over the state variables,
+an array with one axis per variable, since exact filtering entangles
+variables that share an ancestor.
+"""
+import itertools
+import numpy as np
+import instrumentation
+from pomdp import CompiledPOMDP
+
+
+class StateVariable:
+    """A state variable with its transition model. parents names variables
+    of the previous slice (the variable itself included if it persists) and
+    cpt[a, p_1, ..., p_k, x] = P(x | parents, actlist[a]). A cpt without the
+    leading action axis does not depend on the action."""
+
+    def __init__(self, name, values, parents, cpt):
+        self.name = name
+        self.values = list(values)
+        self.parents = list(parents)
+        self.cpt = np.asarray(cpt, dtype=np.float64)
+        self.action_dependent = self.cpt.ndim == len(self.parents) + 2
+
+    def table(self, a):
+        return self.cpt[a] if self.action_dependent else self.cpt
+
+
+class EvidenceVariable:
+    """An evidence variable: parents names state variables of the same
+    slice and cpt[p_1, ..., p_k, e] = P(e | parents)."""
+
+    def __init__(self, name, values, parents, cpt):
+        self.name = name
+        self.values = list(values)
+        self.parents = list(parents)
+        self.cpt = np.asarray(cpt, dtype=np.float64)
+
+
+class UtilityNode:
+    """A utility node: table[p_1, ..., p_k] is the reward for the values of
+    its parents, state variables of the same slice. The reward of a state
+    is the sum of all utility nodes."""
+
+    def __init__(self, parents, table):
+        self.parents = list(parents)
+        self.table = np.asarray(table, dtype=np.float64)
+
+
+class FactoredDBN:
+    """A factored DDN over the given state variables, evidence variables and
+    utility nodes. Beliefs are arrays of shape self.shape, with the axes in
+    the order of variables. Evidence is a {name: value} mapping; variables
+    that were not observed are left out."""
+
+    def __init__(self, actlist, variables, evidence=(), utilities=(), gamma=0.9):
+        if not (0 < gamma <= 1):
+            raise ValueError("A FactoredDBN must have 0 < gamma <= 1")
+        self.actlist = list(actlist)
+        self.action_index = {a: i for i, a in enumerate(self.actlist)}
+        self.variables = list(variables)
+        self.evidence = {e.name: e for e in evidence}
+        self.utilities = list(utilities)
+        self.gamma = gamma
+        self.axis = {v.name: i for i, v in enumerate(self.variables)}
+        self.shape = tuple(len(v.values) for v in self.variables)
+        self.check_consistency()
+        # einsum contraction orders, one per action, found on first use
+        self.paths = {}
+
+    def check_consistency(self):
+        n = len(self.variables)
+        for v in self.variables:
+            expected = tuple(self.shape[self.axis[p]] for p in v.parents) + (len(v.values),)
+            if v.cpt.shape[-len(expected):] != expected or v.cpt.ndim not in (len(expected), len(expected) + 1) \
+                    or (v.action_dependent and v.cpt.shape[0] != len(self.actlist)):
+                raise ValueError("The table of %s does not match its parents and values" % v.name)
+        for e in self.evidence.values():
+            expected = tuple(self.shape[self.axis[p]] for p in e.parents) + (len(e.values),)
+            if e.cpt.shape != expected:
+                raise ValueError("The table of %s does not match its parents and values" % e.name)
+        for u in self.utilities:
+            if u.table.shape != tuple(self.shape[self.axis[p]] for p in u.parents):
+                raise ValueError("A utility table does not match its parents")
+        if n > 26:
+            raise ValueError("At most 26 state variables are supported")
+
+    # Beliefs ----------------------------------------------------------------
+
+    def uniform_belief(self):
+        return np.full(self.shape, 1.0 / np.prod(self.shape))
+
+    def belief_from_marginals(self, marginals):
+        """The belief in which the variables are independent with the given
+        {name: {value: probability}} marginals; variables left out are
+        uniform."""
+
+        b = np.ones(())
+        for v in self.variables:
+            p = marginals.get(v.name)
+            p = np.full(len(v.values), 1.0 / len(v.values)) if p is None else \
+                np.array([p.get(x, 0.0) for x in v.values], dtype=np.float64)
+            b = np.multiply.outer(b, p)
+        return b
+
+    def marginal(self, b, name):
+        """The {value: probability} marginal of one variable."""
+
+        axis = self.axis[name]
+        p = b.sum(axis=tuple(i for i in range(b.ndim) if i != axis))
+        return dict(zip(self.variables[axis].values, p.tolist()))
+
+    # Filtering --------------------------------------------------------------
+
+    def predict(self, b, action):
+        """The predicted belief after doing action, before any evidence:
+        b'(x') = sum_x b(x) prod_i P(x'_i | parents_i(x), a)."""
+
+        a = self.action_index[action]
+        n = len(self.variables)
+        operands = [b, list(range(n))]
+        for i, v in enumerate(self.variables):
+            operands += [v.table(a), [self.axis[p] for p in v.parents] + [n + i]]
+        operands.append(list(range(n, 2 * n)))
+        if a not in self.paths:
+            self.paths[a] = np.einsum_path(*operands, optimize='greedy')[0]
+        return np.einsum(*operands, optimize=self.paths[a])
+
+    def likelihood(self, b, evidence):
+        """b weighted by P(evidence | x) for every joint state x."""
+
+        n = len(self.variables)
+        operands = [b, list(range(n))]
+        for name, value in evidence.items():
+            e = self.evidence[name]
+            operands += [e.cpt[..., e.values.index(value)], [self.axis[p] for p in e.parents]]
+        operands.append(list(range(n)))
+        return np.einsum(*operands)
+
+    def update(self, b, action, evidence):
+        """The filter algorithm: predict, weight by the evidence and
+        normalize. Returns a zero belief if the evidence is impossible."""
+
+        instrumentation.count('belief_updates', filter='factored')
+        b1 = self.likelihood(self.predict(b, action), evidence)
+        total = b1.sum()
+        if total > 0:
+            b1 /= total
+        return b1
+
+    def evidence_probability(self, b, action, evidence):
+        """P(evidence | b, a)."""
+
+        return float(self.likelihood(self.predict(b, action), evidence).sum())
+
+    def reward(self, b):
+        """Expected utility of a belief: the sum of the utility nodes."""
+
+        n = len(self.variables)
+        return float(sum(np.einsum(b, list(range(n)), u.table, [self.axis[p] for p in u.parents], [])
+                         for u in self.utilities))
+
+    # Flat model -------------------------------------------------------------
+
+    def compile(self):
+        """Multiply the network out into a CompiledPOMDP over joint states
+        (tuples of values, in the order of the belief array) and joint
+        evidence (tuples over the evidence variables), for the flat solvers
+        and planners. Its size grows exponentially with the variables."""
+
+        n, size = len(self.variables), int(np.prod(self.shape))
+        states = list(itertools.product(*(v.values for v in self.variables)))
+        indptr, indices, data = [0], [], []
+        for a in range(len(self.actlist)):
+            operands = []
+            for i, v in enumerate(self.variables):
+                operands += [v.table(a), [self.axis[p] for p in v.parents] + [n + i]]
+            T = np.einsum(*operands, list(range(2 * n)), optimize='greedy').reshape(size, size)
+            for row in T:
+                successors = np.nonzero(row)[0]
+                indices.extend(successors.tolist())
+                data.extend(row[successors].tolist())
+                indptr.append(len(indices))
+
+        rewards = np.zeros(self.shape)
+        for u in self.utilities:
+            axes = [self.axis[p] for p in u.parents]
+            shape = [self.shape[i] if i in axes else 1 for i in range(n)]
+            rewards = rewards + np.transpose(u.table, np.argsort(axes)).reshape(shape)
+
+        evidence = list(self.evidence.values())
+        evidence_values = list(itertools.product(*(e.values for e in evidence)))
+        sensor = np.zeros((len(evidence_values), size))
+        for k, values in enumerate(evidence_values):
+            sensor[k] = self.likelihood(np.ones(self.shape), dict(zip(self.evidence, values))).ravel()
+
+        return CompiledPOMDP(states, self.actlist, np.array(indptr, dtype=np.int64),
+                             np.array(indices, dtype=np.int32), np.array(data, dtype=np.float64),
+                             np.ascontiguousarray(rewards, dtype=np.float64).ravel(), np.zeros(size, dtype=bool),
+                             self.gamma, sensor=sensor, evidence_values=evidence_values)
+
+
+def robot_example(length=5, gamma=0.9):
+    """A robot in a corridor of length cells with three factored variables:
+    its position, its battery (which drains when it moves) and whether the
+    charger at the left end works. It senses its position with noise and
+    sees a battery warning; reaching the right end is worth +1 and an empty
+    battery -1."""
+
+    actlist = ['left', 'right', 'stay']
+    positions, battery, charger = list(range(length)), ['empty', 'low', 'full'], [True, False]
+
+    # P(position' | position, action): the move succeeds with 0.8
+    move = np.zeros((3, length, length))
+    for x in positions:
+        for a, dx in enumerate((-1, +1, 0)):
+            target = min(max(x + dx, 0), length - 1)
+            move[a, x, target] += 0.8
+            move[a, x, x] += 0.2
+
+    # P(battery' | battery, charger, position, action): moving drains it,
+    # a working charger at position 0 refills it
+    drain = np.zeros((3, 3, 2, length, 3))
+    for a in range(3):
+        for level in range(3):
+            for c in range(2):
+                for x in positions:
+                    if c == 0 and x == 0:
+                        drain[a, level, c, x, 2] = 1.0
+                    elif a < 2:
+                        drain[a, level, c, x, max(level - 1, 0)] += 0.3
+                        drain[a, level, c, x, level] += 0.7
+                    else:
+                        drain[a, level, c, x, level] = 1.0
+
+    variables = [
+        StateVariable('position', positions, ['position'], move),
+        StateVariable('battery', battery, ['battery', 'charger', 'position'], drain),
+        StateVariable('charger', charger, ['charger'], [[0.95, 0.05], [0.1, 0.9]]),
+    ]
+
+    location = np.zeros((length, length))
+    for x in positions:
+        for y in (x - 1, x, x + 1):
+            if 0 <= y < length:
+                location[x, y] = 1.0
+        location[x] /= location[x].sum()
+    evidence = [
+        EvidenceVariable('location', positions, ['position'], location),
+        EvidenceVariable('warning', [True, False], ['battery'], [[0.9, 0.1], [0.6, 0.4], [0.05, 0.95]]),
+    ]
+
+    goal = np.where(np.arange(length) == length - 1, 1.0, -0.04)
+    utilities = [UtilityNode(['position'], goal), UtilityNode(['battery'], [-1.0, 0.0, 0.0])]
+    return FactoredDBN(actlist, variables, evidence, utilities, gamma)
+
+
+if __name__ == '__main__':
+    dbn = robot_example()
+    b = dbn.belief_from_marginals({'position': {0: 1.0}, 'battery': {'full': 1.0}})
+    for action, evidence in [('right', {'location': 1, 'warning': False}),
+                             ('right', {'location': 2, 'warning': False}),
+                             ('right', {'location': 3, 'warning': True})]:
+        b = dbn.update(b, action, evidence)
+        print(action, evidence, dbn.marginal(b, 'position'), dbn.marginal(b, 'battery'))
@@ -1,15 +1,40 @@
 from grid_pomdp import GridPOMDP
-import random
+from belief import BeliefCache, BeliefModel, SparseBelief
+from expectimax import ExpectimaxPlanner, worker_pool
+from particle import ParticleBelief
+from collections import namedtuple
 import time
+import numpy as np
+import instrumentation
+
+TrajectoryStep = namedtuple('TrajectoryStep', ['action', 'belief_state', 'reward', 'utility', 'seconds'])
 
 class DynamicDecisionNetwork:
-    def __init__(self, max_depth):
+    def __init__(self, max_depth, execution_backend='serial', max_workers=None,
+                 cache_size=4096, cache_quantum=1e-9):
         """
         Initializer function of the class with
         a maximum depth parameter for the
-        belief state forward-chaining
+        belief state forward-chaining.
+        With execution_backend='process' the
+        subtrees of every planning step are
+        evaluated in a process pool of
+        max_workers workers that is created
+        once and shared until close().
+        Plans, new belief states and belief
+        state rewards are memoized in an LRU
+        cache of cache_size entries, keyed on
+        the belief rounded to cache_quantum
         """
+        if execution_backend not in ('serial', 'process'):
+            raise ValueError("execution_backend must be 'serial' or 'process'")
+        self.execution_backend = execution_backend
+        self.max_workers = max_workers
+        self.executor = None
+        self.shared_memory = []
+
         self.grid_pomdb = self.initialize_grid()
+        self.belief_model = BeliefModel(self.grid_pomdb.compile())
         self.belief_state = {
             (0,0) : 1/9,
             (0,1) : 1/9,
@@ -25,7 +50,56 @@ class DynamicDecisionNetwork:
         }
 
         self.max_depth = max_depth
-        self.possible_evidence_indices = [0, 1, 2, 3]
+        self.planner = ExpectimaxPlanner(self.belief_model, max_depth)
+        self.belief_cache = BeliefCache(cache_size, cache_quantum)
+
+    def get_particle_belief_state(self, n_particles=1000, seed=None):
+        """
+        Get the current belief state
+        as a particle belief with the
+        given number of particles
+        """
+        return ParticleBelief.from_belief_state(self.belief_model.model, self.belief_state,
+                                                n_particles, np.random.default_rng(seed))
+
+    def get_executor(self):
+        """
+        Get the process pool of the
+        process backend, creating it
+        on first use. None for the
+        serial backend
+        """
+        if self.execution_backend == 'serial':
+            return None
+        if self.executor is None:
+            self.executor, self.shared_memory = worker_pool(self.planner, self.max_workers)
+        return self.executor
+
+    def get_cache_statistics(self):
+        """
+        Get the hits, misses, hit rate
+        and size of the belief cache
+        """
+        return self.belief_cache.stats()
+
+    def close(self):
+        """
+        Shut down the process pool and
+        release the shared model memory
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        for block in self.shared_memory:
+            block.close()
+            block.unlink()
+        self.shared_memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     def initialize_grid(self):
         """
@@ -40,174 +114,138 @@ class DynamicDecisionNetwork:
             terminals=[(3, 2), (3, 1)], init=(0,0))
         return grid
 
-    def solve_grid(self):
+    @instrumentation.timed('solve_grid')
+    def solve_grid(self, observer=None, max_steps=100):
         """
-        Solve the initialized grid
+        Solve the initialized grid without
+        printing or pausing and return the
+        trajectory as a list of TrajectorySteps
+        holding the chosen action, the new
+        belief state, its expected reward,
+        the planned utility and the planning
+        time in seconds. An optional observer
+        is called with every step as it is
+        taken. Stops at a terminal belief
+        state or after max_steps steps
         """
-        print("Starting grid solving...")
-        while not self.reached_terminal_state(self.belief_state):
-            best_action, new_belief_state, reward = self.get_maximum_utility_of_belief_state(self.belief_state, 0)
+        trajectory = []
+        while not self.reached_terminal_state(self.belief_state) and len(trajectory) < max_steps:
+            start = time.perf_counter()
+            best_action, new_belief_state, utility = self.get_maximum_utility_of_belief_state(self.belief_state, 0)
+            seconds = time.perf_counter() - start
+            instrumentation.observe('planning_seconds', seconds, depth=self.max_depth)
+            if best_action is None:
+                break
             self.perform_action_and_update_belief_state(best_action, new_belief_state)
-        print("Solved the grid successfully!")
+            step = TrajectoryStep(best_action, new_belief_state,
+                                  self.get_belief_state_reward(new_belief_state), utility, seconds)
+            trajectory.append(step)
+            if observer is not None:
+                observer(step)
+        return trajectory
 
     def perform_action_and_update_belief_state(self, action, new_belief_state):
         """
-        Print the best action of a step
-        and the new, assigned belief state.
+        Assign the new belief state
+        reached by the best action
         """
-        print("Performing best action: %s" % (action,))
-        print("New belief state:\n%s" % (new_belief_state,))
-        time.sleep(5)
         self.belief_state = new_belief_state
 
+    def get_sparse_belief_state(self, epsilon=1e-9):
+        """
+        Get the current belief state
+        as a sparse belief that only
+        keeps states with a probability
+        of at least epsilon
+        """
+        return SparseBelief(self.belief_state, epsilon)
+
     def get_maximum_utility_of_belief_state(self, belief_state, depth):
         """
         Calculate the maximum utility
-        of a given belief state.
-        This function calls itself recursively
-        with an incrementing depth parameter
-        until the class instance specific
-        maximum depth is reached  
-        """
-        if self.reached_terminal_state(belief_state):
-            return (None, None, self.get_belief_state_reward(belief_state))
-        elif depth == self.max_depth:
-            return (None, None, self.get_belief_state_reward(belief_state))
-        else:
-            best_action, best_new_belief_state = self.get_best_action_and_new_belief_state_for_belief_state(belief_state)
-            return (best_action, best_new_belief_state, self.get_maximum_utility_of_belief_state(best_new_belief_state, depth+1)[2])
-    
+        of a given belief state by a
+        depth-limited expectimax over
+        actions and evidence, weighted by
+        P(e | b, a), down to the class
+        instance specific maximum depth.
+        Returns the best action, the
+        predicted belief state after it
+        and the utility
+        """
+        b = self.belief_model.to_array(belief_state)
+        key = self.belief_cache.key(b, 'plan', depth)
+        result = self.belief_cache.get(key)
+        if result is None:
+            best_action, utility = self.planner.plan(b, depth, self.get_executor())
+            if best_action is None:
+                result = (None, None, utility)
+            else:
+                new_b = self.belief_model.predict(b, best_action)
+                result = (best_action, self.belief_model.to_belief_state(new_b), utility)
+            self.belief_cache.put(key, result)
+        best_action, new_belief_state, utility = result
+        return (best_action, None if new_belief_state is None else dict(new_belief_state), utility)
+
     def reached_terminal_state(self, belief_state):
         """
         Check if a terminal belief state
         has been reached.
         """
+        if isinstance(belief_state, ParticleBelief):
+            return belief_state.reached_terminal_state()
+
         probability_sum = 0
         for terminal in self.grid_pomdb.terminals:
             probability_sum = probability_sum + belief_state[terminal]
         
-        if probability_sum == 1:
+        if probability_sum >= 1 - 1e-9:
             return True
         else:
             return False
 
-    def get_best_action_and_new_belief_state_for_belief_state(self, belief_state):
-        """
-        Get the best action to execute
-        and the resulting belief state
-        from a given belief state
-        """
-        best_new_belief_state = None
-        best_new_belief_state_reward = 0
-        best_action = None
-
-        action_belief_state_reward = []
-
-        for action in random.sample(self.grid_pomdb.actlist, len(self.grid_pomdb.actlist)):
-            for evidence_index in self.possible_evidence_indices:
-                new_possible_belief_state = self.get_new_belief_state(belief_state, action, evidence_index)
-                belief_state_reward = self.get_belief_state_reward(new_possible_belief_state)
-                
-                action_belief_state_reward.append((action, new_possible_belief_state, belief_state_reward))
-
-                """
-                if belief_state_reward > best_new_belief_state_reward:
-                    best_new_belief_state = new_possible_belief_state
-                    best_new_belief_state_reward = belief_state_reward
-                    best_action = action
-                """
-
-        best_action, best_new_belief_state, best_new_belief_state_reward = max(action_belief_state_reward, key=lambda element:element[2])
-        return (best_action, best_new_belief_state)
-
     def get_new_belief_state(self, belief_state, action, evidence_index):
         """
         Calculate a new belief state
         from a given belief state
         for the execution of a given action
-        with given evidence index
-        """
-        new_belief_state = {}
-        for state in self.grid_pomdb.states:
-            new_state_possibility = self.get_probability_of_new_state_in_new_belief_state(belief_state, state, evidence_index, action)
-            new_belief_state[state] = new_state_possibility
-        return new_belief_state
-
-    def get_probability_of_new_state_in_new_belief_state(self, belief_state, new_state, evidence_index, action):
-        """
-        The filter algorithm
+        with given evidence index.
+        The update runs on the compiled
+        belief model as one matrix-vector
+        product plus normalization.
+        Particle beliefs are updated by
+        the particle filter and sparse
+        beliefs on their support instead
         """
-        normalization_factor = self.get_normalization_factor(belief_state, new_state)
-        probability_of_evidence_in_new_state = self.grid_pomdb.evidences[new_state][evidence_index][0]
+        if isinstance(belief_state, ParticleBelief):
+            return belief_state.update(action, evidence_index)
+        if isinstance(belief_state, SparseBelief):
+            return belief_state.filtered(self.grid_pomdb, action, evidence_index)
 
-        state_sum = 0
-        for state in self.grid_pomdb.states:
-            probability_to_reach_new_state_from_current_state_with_given_action = self.get_probability_to_reach_new_state_from_current_state_with_given_action(new_state, state, action)
-            probability_of_state = belief_state[state]
-            state_sum = state_sum + (probability_to_reach_new_state_from_current_state_with_given_action * probability_of_state)
-
-        return normalization_factor * probability_of_evidence_in_new_state * state_sum
-
-    def get_normalization_factor(self, belief_state, new_state):
-        """
-        Get the normalization factor
-        for a given belief state and
-        a specific state for the filter
-        algorithm
-        """
-        current_belief_state_probability_of_new_state = belief_state[new_state]
-        
-        sum_of_possible_follow_up_state_probabilities = 0
-        for possible_follow_up_state in self.get_possible_follow_up_states(new_state):
-            sum_of_possible_follow_up_state_probabilities = sum_of_possible_follow_up_state_probabilities + belief_state[possible_follow_up_state]
-
-        if sum_of_possible_follow_up_state_probabilities == 0:
-            return 0
-        else:
-            return current_belief_state_probability_of_new_state / sum_of_possible_follow_up_state_probabilities
-    
-    def get_possible_follow_up_states(self, state):
-        """
-        Get all possible states which can be
-        reached from a given state
-        """
-        possible_follow_up_states = []
-        
-        for action in self.grid_pomdb.transitions[state]:
-            for probability, possible_follow_up_state in self.grid_pomdb.transitions[state][action]:
-                if possible_follow_up_state not in possible_follow_up_states:
-                    possible_follow_up_states.append(possible_follow_up_state)
-        
-        return possible_follow_up_states
-
-
-    def get_probability_to_reach_new_state_from_current_state_with_given_action(
-        self,
-        new_state,
-        current_state,
-        action):
-        """
-        Get the probability to reach
-        a new given state from a given
-        current state with a given action
-        """
-        for probability, possible_new_state in self.grid_pomdb.transitions[current_state][action]:
-            if possible_new_state == new_state:
-                return probability
-        return 0
+        b = self.belief_model.to_array(belief_state)
+        key = self.belief_cache.key(b, 'update', action, evidence_index)
+        new_belief_state = self.belief_cache.get(key)
+        if new_belief_state is None:
+            new_b = self.belief_model.update(b, action, evidence_index)
+            new_belief_state = self.belief_model.to_belief_state(new_b)
+            self.belief_cache.put(key, new_belief_state)
+        return dict(new_belief_state)
 
     def get_belief_state_reward(self, belief_state):
         """
         Get the reward for a
         given belief state 
         """
-        state_reward_sum = 0
-        
-        for state in belief_state:
-            state_reward = self.grid_pomdb.rewards[state]
-            weighted_state_reward = state_reward * belief_state[state]
-            state_reward_sum = state_reward_sum + weighted_state_reward
-        
+        if isinstance(belief_state, ParticleBelief):
+            return belief_state.get_belief_state_reward()
+        if isinstance(belief_state, SparseBelief):
+            return belief_state.reward(self.grid_pomdb)
+
+        b = self.belief_model.to_array(belief_state)
+        key = self.belief_cache.key(b, 'reward')
+        state_reward_sum = self.belief_cache.get(key)
+        if state_reward_sum is None:
+            state_reward_sum = self.belief_model.reward(b)
+            self.belief_cache.put(key, state_reward_sum)
         return state_reward_sum
 
     def get_belief_state_utility(self, belief_state):
@@ -240,5 +278,20 @@ class DynamicDecisionNetwork:
         # return reward of state + (result of above)
         return reward_current_state + best_follow_up_state_utility
 
-ddn = DynamicDecisionNetwork(20)
-ddn.solve_grid()
\ No newline at end of file
+
+def print_step(step, pause=5):
+    """
+    Observer for interactive runs:
+    print the action and the new belief
+    state of a step, then pause
+    """
+    print("Performing best action: %s" % (step.action,))
+    print("New belief state:\n%s" % (step.belief_state,))
+    time.sleep(pause)
+
+
+if __name__ == '__main__':
+    with DynamicDecisionNetwork(4) as ddn:
+        print("Starting grid solving...")
+        ddn.solve_grid(observer=print_step)
+        print("Solved the grid successfully!")
\ No newline at end of file
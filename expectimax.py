@@ -0,0 +1,167 @@
+"""
+Depth-limited expectimax over belief states.
+From a belief b every action a is expanded into one child per evidence value
+e, weighted by P(e | b, a), and the utility of b is
+    U(b) = R(b) + gamma * max_a sum_e P(e | b, a) U(b'_{a,e})
+down to a fixed depth. Belief mass that reaches a terminal state collects
+its reward once and then leaves the tree. Beliefs are memoized in a
+transposition table keyed on the remaining depth and the belief vector
+rounded to a fixed quantum, so identical beliefs reached by different paths
+are evaluated once. The table is a bounded LRU BeliefCache, so a planner
+that serves many searches keeps a fixed memory footprint.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from belief import BeliefCache, BeliefModel
+from pomdp import CompiledPOMDP
+
+
+class ExpectimaxPlanner:
+    """Expectimax planner on a BeliefModel. max_depth is the number of
+    actions to look ahead, quantum the rounding step for transposition table
+    keys, min_probability the evidence probability below which a branch
+    is not expanded and capacity the most beliefs the transposition table
+    holds."""
+
+    def __init__(self, belief_model, max_depth, gamma=None, quantum=1e-4, min_probability=1e-9,
+                 capacity=100000):
+        self.belief_model = belief_model
+        self.model = belief_model.model
+        self.max_depth = max_depth
+        self.gamma = belief_model.model.gamma if gamma is None else gamma
+        self.quantum = quantum
+        self.min_probability = min_probability
+        self.capacity = capacity
+        self.transposition_table = BeliefCache(capacity, quantum, name='transposition_table')
+
+        # scatter layout to push one belief through every action at once
+        n = self.model.n_states
+        self.sources = self.model.rows % n
+        self.targets = (self.model.rows // n) * n + self.model.indices
+        self.shape = (len(self.model.actlist), n)
+
+    def key(self, b, remaining):
+        """Transposition table key of a belief vector with remaining depth."""
+
+        return self.transposition_table.key(b, remaining)
+
+    def plan(self, b, depth=0, executor=None):
+        """Return (best action, utility) of belief vector b at depth. The
+        action is None at the depth limit or when b is fully terminal. With
+        an executor from worker_pool, the subtrees below b are evaluated
+        in the pool."""
+
+        return self.expand(b, self.max_depth - depth, executor)
+
+    def expand(self, b, remaining, executor=None):
+        reward = self.belief_model.reward(b)
+        alive = np.where(self.model.terminal_mask, 0.0, b)
+        if remaining <= 0 or alive.sum() <= self.min_probability:
+            return None, reward
+
+        key = self.key(b, remaining)
+        cached = self.transposition_table.get(key)
+        if cached is not None:
+            return cached
+
+        # children[a, e] is the unnormalized belief after action a and evidence e
+        predicted = np.bincount(self.targets, weights=self.model.data * alive[self.sources],
+                                minlength=self.shape[0] * self.shape[1]).reshape(self.shape)
+        children = predicted[:, None, :] * self.model.sensor[None, :, :]
+        probabilities = children.sum(axis=2)
+
+        expanded = probabilities > self.min_probability
+        if remaining == 1:
+            # the children are leaves, whose utility is just their reward
+            values = np.where(expanded, children @ self.model.rewards, 0.0).sum(axis=1)
+        elif executor is not None:
+            branches = list(zip(*np.nonzero(expanded)))
+            futures = [executor.submit(_expand_in_worker, children[a, e] / probabilities[a, e], remaining - 1)
+                       for a, e in branches]
+            values = np.zeros(len(self.model.actlist))
+            for (a, e), future in zip(branches, futures):
+                values[a] += probabilities[a, e] * future.result()
+        else:
+            values = np.zeros(len(self.model.actlist))
+            for a, e in zip(*np.nonzero(expanded)):
+                p = probabilities[a, e]
+                values[a] += p * self.expand(children[a, e] / p, remaining - 1)[1]
+
+        best = int(np.argmax(values))
+        best_action, best_value = self.model.actlist[best], float(values[best])
+
+        result = (best_action, reward + self.gamma * best_value)
+        self.transposition_table.put(key, result)
+        return result
+
+
+# ______________________________________________________________________________
+# Process pool backend. The compiled model is copied into shared memory once;
+# every worker attaches to it in its initializer and keeps its own planner
+# (and transposition table) for the life of the pool, so a task only carries
+# one belief vector.
+
+_SHARED_ARRAYS = ('indptr', 'indices', 'data', 'rewards', 'terminal_mask', 'sensor')
+_worker_planner = None
+_worker_memory = None
+
+
+def share_model(model):
+    """Copy the arrays of a CompiledPOMDP into shared memory. Returns the
+    list of SharedMemory blocks, which the caller must close and unlink, and
+    a picklable description of the model for attach_model."""
+
+    blocks, arrays = [], {}
+    for name in _SHARED_ARRAYS:
+        array = getattr(model, name)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        arrays[name] = (block.name, array.shape, array.dtype.str)
+    spec = {'arrays': arrays, 'states': model.states, 'actlist': model.actlist,
+            'evidence_values': model.evidence_values, 'gamma': model.gamma}
+    return blocks, spec
+
+
+def attach_model(spec):
+    """Rebuild a CompiledPOMDP on the shared memory described by spec.
+    Returns the model and the attached SharedMemory blocks, which must stay
+    referenced while the model is in use."""
+
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec['arrays'].items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    model = CompiledPOMDP(spec['states'], spec['actlist'], arrays['indptr'], arrays['indices'],
+                          arrays['data'], arrays['rewards'], arrays['terminal_mask'], spec['gamma'],
+                          sensor=arrays['sensor'], evidence_values=spec['evidence_values'])
+    return model, blocks
+
+
+def worker_pool(planner, max_workers=None):
+    """Create a process pool whose workers plan on a shared copy of the
+    planner's model with the same settings. Returns the executor and the
+    SharedMemory blocks to release (close and unlink) after shutdown."""
+
+    blocks, spec = share_model(planner.model)
+    settings = (planner.max_depth, planner.gamma, planner.quantum, planner.min_probability,
+                planner.capacity)
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                   initargs=(spec, settings))
+    return executor, blocks
+
+
+def _init_worker(spec, settings):
+    global _worker_planner, _worker_memory
+    model, _worker_memory = attach_model(spec)
+    _worker_planner = ExpectimaxPlanner(BeliefModel(model), *settings)
+
+
+def _expand_in_worker(b, remaining):
+    return _worker_planner.expand(b, remaining)[1]
+
+
+def _plan_in_worker(beliefs):
+    return [_worker_planner.plan(b) for b in beliefs]
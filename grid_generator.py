@@ -0,0 +1,177 @@
+"""
+Procedural grids for GridMDP/GridPOMDP scaling tests.
+generate_grid makes a seeded random, maze or room layout of any size with
+terminals and rewards placed on it, as a (rows, cols) array of rewards with
+NaN for obstacles (row 0 at the bottom, indexed [y, x]). compile_grid turns
+such an array straight into the CompiledMDP or CompiledPOMDP that
+GridMDP(...).compile() or GridPOMDP(...).compile() would produce, without
+building any nested dict transitions. to_nested_list gives the list of lists
+that GridMDP and GridPOMDP take, for grids small enough for them.
+"""
+from collections import deque
+import numpy as np
+from mdp import CompiledMDP
+from pomdp import CompiledPOMDP
+from utils import orientations
+
+
+def generate_layout(rows, cols, kind='random', obstacle_density=0.2, room_size=8, rng=None):
+    """Return a (rows, cols) boolean array of free cells. kind is 'random'
+    (independent obstacles with obstacle_density), 'maze' (a perfect maze
+    carved by randomized depth-first search) or 'rooms' (rooms of room_size
+    cells with a door in every wall, plus random obstacles). Only the
+    largest connected region is kept free, so every state is reachable."""
+
+    rng = rng if rng is not None else np.random.default_rng()
+    if kind == 'random':
+        free = rng.random((rows, cols)) >= obstacle_density
+    elif kind == 'maze':
+        free = _maze(rows, cols, rng)
+    elif kind == 'rooms':
+        free = rng.random((rows, cols)) >= obstacle_density
+        for wall in range(room_size, rows, room_size + 1):
+            free[wall, :] = False
+            for lo in range(0, cols, room_size + 1):
+                free[wall, rng.integers(lo, min(lo + room_size, cols))] = True
+        for wall in range(room_size, cols, room_size + 1):
+            free[:, wall] = False
+            for lo in range(0, rows, room_size + 1):
+                free[rng.integers(lo, min(lo + room_size, rows)), wall] = True
+    else:
+        raise ValueError("kind must be 'random', 'maze' or 'rooms'")
+    return _largest_region(free)
+
+
+def _maze(rows, cols, rng):
+    """Carve a perfect maze: cells at even coordinates, walls between them."""
+
+    free = np.zeros((rows, cols), dtype=bool)
+    free[0, 0] = True
+    stack = [(0, 0)]
+    steps = [(0, 2), (2, 0), (0, -2), (-2, 0)]
+    while stack:
+        y, x = stack[-1]
+        options = [(y + dy, x + dx) for dy, dx in steps
+                   if 0 <= y + dy < rows and 0 <= x + dx < cols and not free[y + dy, x + dx]]
+        if not options:
+            stack.pop()
+            continue
+        ny, nx = options[rng.integers(len(options))]
+        free[(y + ny) // 2, (x + nx) // 2] = True
+        free[ny, nx] = True
+        stack.append((ny, nx))
+    return free
+
+
+def _largest_region(free):
+    """Keep only the largest 4-connected region of free cells."""
+
+    rows, cols = free.shape
+    label = np.full(free.shape, -1, dtype=np.int64)
+    best, best_size = -1, 0
+    for start in zip(*np.nonzero(free)):
+        if label[start] >= 0:
+            continue
+        region, size = label.max() + 1, 0
+        label[start] = region
+        queue = deque([start])
+        while queue:
+            y, x = queue.popleft()
+            size += 1
+            for ny, nx in ((y + 1, x), (y - 1, x), (y, x + 1), (y, x - 1)):
+                if 0 <= ny < rows and 0 <= nx < cols and free[ny, nx] and label[ny, nx] < 0:
+                    label[ny, nx] = region
+                    queue.append((ny, nx))
+        if size > best_size:
+            best, best_size = region, size
+    return label == best
+
+
+def generate_grid(rows, cols, kind='random', obstacle_density=0.2, room_size=8,
+                  n_goals=1, n_pits=1, goal_reward=+1.0, pit_reward=-1.0,
+                  step_reward=-0.04, reward_noise=0.0, seed=None):
+    """Generate a grid world. Goal and pit terminals are placed on distinct
+    random free cells and every other free cell gets step_reward plus
+    Gaussian noise with standard deviation reward_noise. Returns the
+    (rows, cols) reward array with NaN for obstacles and the list of
+    terminals as (x, y) states."""
+
+    rng = np.random.default_rng(seed)
+    free = generate_layout(rows, cols, kind, obstacle_density, room_size, rng)
+    rewards = np.where(free, step_reward, np.nan)
+    if reward_noise:
+        rewards += np.where(free, rng.normal(0.0, reward_noise, free.shape), 0.0)
+
+    ys, xs = np.nonzero(free)
+    if n_goals + n_pits > len(ys):
+        raise ValueError("Not enough free cells for %d terminals" % (n_goals + n_pits))
+    chosen = rng.choice(len(ys), size=n_goals + n_pits, replace=False)
+    terminals = []
+    for k, i in enumerate(chosen):
+        rewards[ys[i], xs[i]] = goal_reward if k < n_goals else pit_reward
+        terminals.append((int(xs[i]), int(ys[i])))
+    return rewards, terminals
+
+
+def to_nested_list(rewards):
+    """The list of lists (top row first, None for obstacles) that GridMDP
+    and GridPOMDP take. Note that they treat a reward of 0 as an obstacle."""
+
+    return [[None if np.isnan(r) else float(r) for r in row] for row in rewards[::-1]]
+
+
+def compile_grid(rewards, terminals, gamma=.9, perception_failure=None):
+    """Compile a reward array straight into the model of a GridMDP, or of a
+    GridPOMDP if perception_failure is given: the intended move succeeds
+    with probability 0.8 and the agent slips to either side with 0.1;
+    moves into obstacles or off the grid stay put. The wall sensor is wrong
+    with probability perception_failure, split over the neighbouring counts."""
+
+    rewards = np.asarray(rewards, dtype=np.float64)
+    rows, cols = rewards.shape
+    free = ~np.isnan(rewards)
+    # states are (x, y), numbered in sorted order like MDP.compile
+    xs, ys = np.nonzero(free.T)
+    n, A = len(xs), len(orientations)
+    index = np.full((rows, cols), -1, dtype=np.int64)
+    index[ys, xs] = np.arange(n)
+
+    def move(dx, dy):
+        nx, ny = xs + dx, ys + dy
+        inside = (nx >= 0) & (nx < cols) & (ny >= 0) & (ny < rows)
+        target = np.full(n, -1, dtype=np.int64)
+        target[inside] = index[ny[inside], nx[inside]]
+        return np.where(target >= 0, target, np.arange(n))
+
+    moves = [move(dx, dy) for (dx, dy) in orientations]
+    terminal_mask = np.zeros(n, dtype=bool)
+    for (x, y) in terminals:
+        terminal_mask[index[y, x]] = True
+
+    # three entries per (action, state) row: ahead, right turn and left turn
+    row_ids, targets, probabilities = [], [], []
+    live = np.nonzero(~terminal_mask)[0]
+    for a in range(A):
+        for turn, p in ((0, 0.8), (-1, 0.1), (+1, 0.1)):
+            row_ids.append(a * n + live)
+            targets.append(moves[(a + turn) % A][live])
+            probabilities.append(np.full(len(live), p))
+    keys = np.concatenate(row_ids) * n + np.concatenate(targets)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    data = np.bincount(inverse, weights=np.concatenate(probabilities))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(keys // n, minlength=A * n))))
+
+    states = list(zip(xs.tolist(), ys.tolist()))
+    model_rewards = rewards[ys, xs]
+    if perception_failure is None:
+        return CompiledMDP(states, orientations, indptr, (keys % n).astype(np.int32), data,
+                           model_rewards, terminal_mask, gamma)
+
+    walls = sum((m == np.arange(n)).astype(np.int64) for m in moves)
+    evidence_values = [0, 1, 2, 3]
+    sensor = np.zeros((len(evidence_values), n))
+    for w in evidence_values:
+        sensor[w] = np.where(walls == w, 1.0 - perception_failure,
+                             np.where(np.abs(walls - w) == 1, perception_failure / 2, 0.0))
+    return CompiledPOMDP(states, orientations, indptr, (keys % n).astype(np.int32), data,
+                         model_rewards, terminal_mask, gamma, sensor=sensor, evidence_values=evidence_values)
@@ -30,6 +30,17 @@ class GridMDP(MDP):
                      terminals=terminals, transitions=transitions,
                      reward=reward, states=states, gamma=gamma)
 
+    def update_cells(self, changes, terminals=None):
+        """Change some cells in place. changes maps (x, y) to a new reward,
+        or to None to turn the cell into an obstacle; a reward on an obstacle
+        frees it. Only the changed cells and, where an obstacle appeared or
+        vanished, their neighbours get new transitions, and the indexes are
+        patched for them alone. terminals, if given, replaces the terminal
+        states. Returns the set of states whose reward, transitions or
+        terminal status changed, for value_iteration_incremental."""
+
+        return update_grid_cells(self, self.reward, changes, terminals)
+
     def calculate_T(self, state, action):
         if action:
             return [(0.8, self.go(state, action)),
@@ -59,6 +70,47 @@ class GridMDP(MDP):
         return self.to_grid({s: chars[a] for (s, a) in policy.items()})
 
 
+def update_grid_cells(grid, reward, changes, terminals=None, refresh=None):
+    """The bookkeeping of GridMDP.update_cells, shared with GridPOMDP:
+    apply changes to grid, a grid model with cells, states, transitions and
+    terminals, and to reward, its {state: reward} dict. refresh(s), if
+    given, is called for every state whose neighbourhood changed, after its
+    transitions, to recompute what else depends on it; s may have become an
+    obstacle. Returns the set of changed states."""
+
+    changed, opened_or_closed = set(), set()
+    for (x, y), r in changes.items():
+        grid.grid[y][x] = r
+        s = (x, y)
+        if r:
+            if s not in grid.states:
+                grid.states.add(s)
+                opened_or_closed.add(s)
+            reward[s] = r
+        elif s in grid.states:
+            grid.states.remove(s)
+            opened_or_closed.add(s)
+            del reward[s]
+        changed.add(s)
+
+    affected = set(opened_or_closed)
+    for s in opened_or_closed:
+        affected.update(vector_add(s, a) for a in grid.actlist)
+    for s in affected:
+        if s in grid.states:
+            grid.transitions[s] = {a: grid.calculate_T(s, a) for a in grid.actlist}
+        else:
+            grid.transitions.pop(s, None)
+        if refresh is not None:
+            refresh(s)
+    grid.update_index(affected)
+
+    if terminals is not None:
+        changed |= set(grid.terminals) ^ set(terminals)
+        grid.terminals = terminals
+    return {s for s in changed | affected if s in grid.states or s in changes}
+
+
 # ______________________________________________________________________________
 
 
@@ -77,11 +129,10 @@ sequential_decision_environment_big = GridMDP([[r, r, r, r,r,r,+1,r,r],
                                           terminals=[(6, 2), (7, 1)])
 # ______________________________________________________________________________
 
-pi = best_policy(sequential_decision_environment_big, value_iteration(sequential_decision_environment_big, .01))
-sequential_decision_environment_big.to_arrows(pi)
-from utils import print_table
-print_table(sequential_decision_environment_big.to_arrows(pi))
-print("\n")
-pi = policy_iteration(sequential_decision_environment)
-sequential_decision_environment.to_arrows(pi)
-print_table(sequential_decision_environment.to_arrows(pi))
\ No newline at end of file
+if __name__ == '__main__':
+    from utils import print_table
+    pi = best_policy(sequential_decision_environment_big, value_iteration(sequential_decision_environment_big, .01))
+    print_table(sequential_decision_environment_big.to_arrows(pi))
+    print("\n")
+    pi = policy_iteration(sequential_decision_environment)
+    print_table(sequential_decision_environment.to_arrows(pi))
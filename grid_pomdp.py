@@ -1,6 +1,11 @@
-from pomdp import POMDP
+from grid_mdp import update_grid_cells
+from mdp import _compiled
+from pomdp import POMDP, prune_pointwise_dominated
+from policy import AlphaVectorPolicy
 from utils import vector_add, orientations, turn_right, turn_left, EAST, NORTH, WEST, SOUTH, Matrix
 from collections import defaultdict
+import numpy as np
+import instrumentation
 
 class GridPOMDP(POMDP):
     """Added perception to the GridMDP. The Agent does not know where he begins (only that its not a terminal state).
@@ -22,6 +27,7 @@ class GridPOMDP(POMDP):
                     rewards[(x, y)] = grid[y][x]
         self.states = states
         self.actlist = orientations
+        self.perception_failure = perception_failure
         transitions = {}
         for s in states:
             transitions[s] = {}
@@ -35,6 +41,20 @@ class GridPOMDP(POMDP):
                      terminals = terminals, transitions=transitions, evidences = evidences,
                      rewards = rewards, states=states, gamma=gamma)
 
+    def update_cells(self, changes, terminals=None):
+        """Change some cells in place, like GridMDP.update_cells. Where an
+        obstacle appeared or vanished, the neighbours also get new wall
+        counts, so their evidence is recalculated along with their
+        transitions. Returns the set of changed states."""
+
+        def refresh_evidence(s):
+            if s in self.states:
+                self.evidences[s] = self.calculate_evidence(s, self.perception_failure)
+            else:
+                self.evidences.pop(s, None)
+
+        return update_grid_cells(self, self.rewards, changes, terminals, refresh_evidence)
+
     def calculate_evidence(self, state, perception_failure):
         # tests movements in every direction (every action). For each failed move, there is a wall
         walls = self.get_walls_count(state)
@@ -89,6 +109,7 @@ class GridPOMDP(POMDP):
 # ______________________________________________________________________________
 
 
+@instrumentation.timed('pomdp_value_iteration')
 def pomdp_value_iteration(pomdp, epsilon=0.1):
     """Solving a pomdp.pomdpy by value iteration."""
 
@@ -114,11 +135,175 @@ def pomdp_value_iteration(pomdp, epsilon=0.1):
 
         U = pomdp.remove_dominated_plans_fast(U1)
         # replace with U = pomdp.remove_dominated_plans(U1) for accurate calculations
+        if instrumentation.enabled():
+            generated = sum(len(vectors) for vectors in U1.values())
+            instrumentation.count('alpha_vectors_generated', generated)
+            instrumentation.count('alpha_vectors_pruned', generated - sum(len(vectors) for vectors in U.values()))
 
         if count > 10:
-            if pomdp.max_difference(U, prev_U) < epsilon * (1 - pomdp.gamma) / pomdp.gamma:
+            difference = pomdp.max_difference(U, prev_U)
+            instrumentation.observe('residual', difference, solver='pomdp_value_iteration')
+            if difference < epsilon * (1 - pomdp.gamma) / pomdp.gamma:
                 return U
 
+# ______________________________________________________________________________
+
+
+def sample_beliefs(model, n, initial=None, restart=0.1, seed=None):
+    """Sample n distinct belief vectors of a CompiledPOMDP by random walks:
+    from the initial belief (uniform over non-terminal states by default)
+    take random actions, draw evidence from P(e | b, a) and filter. A walk
+    restarts when its belief is (nearly) terminal or with probability
+    restart at every step."""
+
+    rng = np.random.default_rng(seed)
+    if initial is None:
+        initial = np.where(model.terminal_mask, 0.0, 1.0)
+        initial /= initial.sum()
+    beliefs = {}
+    b = initial
+    beliefs[np.round(b, 6).tobytes()] = b
+    for _ in range(100 * n):
+        if len(beliefs) >= n:
+            break
+        alive = np.where(model.terminal_mask, 0.0, b)
+        if alive.sum() < 1e-6 or rng.random() < restart:
+            b = initial
+            continue
+        predicted = model.propagate(b, model.actlist[rng.integers(len(model.actlist))])
+        probabilities = model.sensor @ predicted
+        e = rng.choice(len(probabilities), p=probabilities / probabilities.sum())
+        b = predicted * model.sensor[e] / probabilities[e]
+        beliefs.setdefault(np.round(b, 6).tobytes(), b)
+    return np.array(list(beliefs.values()))
+
+
+def backup_projections(model, alphas):
+    """The (actions, evidences, K, states) array g of the K alpha vectors
+    pushed back through every action and evidence:
+        g[a, e, k, s] = sum_s' P(s'|s, a) P(e|s') alphas[k, s']
+    It depends on the alpha vectors only, so one array serves every point
+    backed up against the same vectors. Rows of terminal states are 0."""
+
+    successors, probabilities = model.successor_table()
+    A, E = len(model.actlist), len(model.evidence_values)
+    g = np.zeros((A, E) + alphas.shape)
+    for e in range(E):
+        weighted = alphas * model.sensor[e]
+        for a in range(A):
+            for w in range(successors.shape[2]):
+                g[a, e] += weighted[:, successors[a, :, w]] * probabilities[a, :, w]
+    return g
+
+
+def point_based_backup(model, alphas, beliefs, g=None):
+    """Bellman backup of the alpha vectors at every belief point. Returns
+    an (N, states) array with the new alpha vector of every belief and the
+    N indices of their actions. Rows of terminal states get no future term.
+    g is backup_projections(model, alphas), computed here if not given."""
+
+    if g is None:
+        g = backup_projections(model, alphas)
+    A, E = g.shape[:2]
+    best = np.full(len(beliefs), -np.inf)
+    new_alphas = np.zeros_like(beliefs)
+    new_actions = np.zeros(len(beliefs), dtype=np.int64)
+    for a in range(A):
+        alpha_a = np.tile(model.rewards, (len(beliefs), 1))
+        for e in range(E):
+            alpha_a += model.gamma * g[a, e][np.argmax(beliefs @ g[a, e].T, axis=1)]
+        values = np.einsum('ij,ij->i', alpha_a, beliefs)
+        improved = values > best
+        best[improved] = values[improved]
+        new_alphas[improved] = alpha_a[improved]
+        new_actions[improved] = a
+    return new_alphas, new_actions
+
+
+def lower_bound(model):
+    """A value no belief can fall below: collect the worst reward forever,
+    or once if that reward is positive and the agent stops in a terminal."""
+
+    worst = model.rewards.min()
+    return min(worst, worst / (1 - model.gamma))
+
+
+@instrumentation.timed('point_based_value_iteration')
+def point_based_value_iteration(pomdp, n_beliefs=100, epsilon=1e-3, max_iterations=200,
+                                max_alphas=None, beliefs=None, seed=None, initial=None):
+    """Solving a POMDP by point-based value iteration (Perseus). A set of
+    belief points is sampled once; every iteration backs up randomly chosen
+    points until the value of every point has improved, so the alpha
+    vectors stay bounded by the number of points (and by max_alphas if
+    given). pomdp is a POMDP or a CompiledPOMDP, e.g. from compile_grid
+    or CompiledPOMDP.load; the solver works on the compiled model. initial,
+    an AlphaVectorPolicy over the same states (see remap_alpha_vectors),
+    warm-starts the iterations. Returns an AlphaVectorPolicy."""
+
+    model = _compiled(pomdp)
+    rng = np.random.default_rng(seed)
+    if beliefs is None:
+        beliefs = sample_beliefs(model, n_beliefs, seed=seed)
+
+    if initial is not None:
+        alphas, actions = np.array(initial.alphas), np.array(initial.actions)
+    else:
+        alphas = np.full((1, model.n_states), lower_bound(model))
+        actions = np.zeros(1, dtype=np.int64)
+
+    for _ in range(max_iterations):
+        values = (beliefs @ alphas.T).max(axis=1)
+        new_alphas, new_actions = [], []
+        new_values = np.full(len(beliefs), -np.inf)
+        pending = np.ones(len(beliefs), dtype=bool)
+        g = backup_projections(model, alphas)
+        while pending.any():
+            i = rng.choice(np.nonzero(pending)[0])
+            alpha, action = point_based_backup(model, alphas, beliefs[i:i + 1], g)
+            if alpha[0] @ beliefs[i] < values[i]:
+                # keep the old best vector of this point instead
+                k = np.argmax(alphas @ beliefs[i])
+                alpha, action = alphas[k:k + 1], actions[k:k + 1]
+            new_alphas.append(alpha[0])
+            new_actions.append(action[0])
+            new_values = np.maximum(new_values, beliefs @ alpha[0])
+            pending &= new_values < values
+            pending[i] = False
+
+        delta = np.max(new_values - values)
+        alphas, actions = np.array(new_alphas), np.array(new_actions)
+        keep = prune_pointwise_dominated(alphas)
+        alphas, actions = alphas[keep], actions[keep]
+        if max_alphas is not None and len(alphas) > max_alphas:
+            wins = np.bincount(np.argmax(beliefs @ alphas.T, axis=1), minlength=len(alphas))
+            keep = np.argsort(-wins, kind='stable')[:max_alphas]
+            alphas, actions = alphas[keep], actions[keep]
+        instrumentation.count('point_based_backups', len(new_alphas))
+        instrumentation.count('alpha_vectors_generated', len(new_alphas))
+        instrumentation.count('alpha_vectors_pruned', len(new_alphas) - len(alphas))
+        instrumentation.observe('residual', delta, solver='point_based_value_iteration')
+        if delta < epsilon:
+            break
+
+    return AlphaVectorPolicy(alphas, actions, model.actlist, model.states)
+
+
+def remap_alpha_vectors(policy, model, shift=0.0):
+    """Carry the alpha vectors of a policy over to a changed model, e.g.
+    after GridPOMDP.update_cells, as the initial vectors of
+    point_based_value_iteration. Entries of states that still exist are
+    kept and lowered by shift; new states get the lower bound of the new
+    model. Perseus never lets the value of a belief point drop, so the
+    vectors should stay lower bounds: if rewards fell by up to d, pass
+    shift=d / (1 - gamma)."""
+
+    alphas = np.full((len(policy.alphas), model.n_states), lower_bound(model))
+    kept = [(i, policy.index[s]) for i, s in enumerate(model.states) if s in policy.index]
+    if kept:
+        new, old = map(list, zip(*kept))
+        alphas[:, new] = policy.alphas[:, old] - shift
+    return AlphaVectorPolicy(alphas, policy.actions, model.actlist, model.states)
+
 """
 r = -0.4
 env = GridPOMDP([
@@ -0,0 +1,170 @@
+"""
+Opt-in instrumentation of the solvers, filters and planners.
+The solvers report what they do as events: counts (Bellman backups, belief
+updates, alpha vectors generated and pruned, memo hits and misses), observed
+values (the residual of every iteration) and timings (every solve). Events
+go to one sink, e.g. a MemoryCollector for tests and notebooks or a
+JSONLinesSink for production logs:
+
+    with instrumented(MemoryCollector()) as collector:
+        value_iteration(mdp)
+    collector.counters['bellman_backups']
+
+While no sink is set every hook returns after one global lookup, so the
+solvers pay almost nothing for being instrumented. The hooks report per
+sweep or per call, never per state.
+"""
+import contextlib
+import functools
+import json
+import time
+from collections import defaultdict
+
+sink = None
+
+
+def enable(new_sink):
+    """Send all events to new_sink, an object with an emit(event) method."""
+
+    global sink
+    sink = new_sink
+
+
+def disable():
+    global sink
+    sink = None
+
+
+def enabled():
+    return sink is not None
+
+
+@contextlib.contextmanager
+def instrumented(new_sink):
+    """Send events to new_sink inside the with block, then restore the
+    previous sink. Yields new_sink."""
+
+    global sink
+    previous, sink = sink, new_sink
+    try:
+        yield new_sink
+    finally:
+        sink = previous
+
+
+def emit(kind, name, value, tags):
+    event = {'kind': kind, 'name': name, 'value': value, 'time': time.time()}
+    event.update(tags)
+    sink.emit(event)
+
+
+def count(name, n=1, **tags):
+    """Add n to the counter name."""
+
+    if sink is not None:
+        emit('count', name, int(n), tags)
+
+
+def observe(name, value, **tags):
+    """Record one value of a series, e.g. the residual of an iteration."""
+
+    if sink is not None:
+        emit('value', name, float(value), tags)
+
+
+class Timer:
+    """Context manager that emits the seconds spent in its block."""
+
+    def __init__(self, name, tags):
+        self.name, self.tags = name, tags
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if sink is not None:
+            emit('time', self.name, time.perf_counter() - self.start, self.tags)
+
+
+_null_timer = contextlib.nullcontext()
+
+
+def timer(name, **tags):
+    """Time a with block as name."""
+
+    return _null_timer if sink is None else Timer(name, tags)
+
+
+def timed(name):
+    """Decorator that times every call of a function as name."""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if sink is None:
+                return function(*args, **kwargs)
+            with Timer(name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ______________________________________________________________________________
+# Sinks
+
+
+class MemoryCollector:
+    """Keeps totals in memory: counters[name] is the sum of all counts,
+    values[name] the list of observed values and timers[name] the list of
+    timings in seconds. With keep_events=True every event is kept as well."""
+
+    def __init__(self, keep_events=False):
+        self.counters = defaultdict(int)
+        self.values = defaultdict(list)
+        self.timers = defaultdict(list)
+        self.events = [] if keep_events else None
+
+    def emit(self, event):
+        if event['kind'] == 'count':
+            self.counters[event['name']] += event['value']
+        elif event['kind'] == 'value':
+            self.values[event['name']].append(event['value'])
+        else:
+            self.timers[event['name']].append(event['value'])
+        if self.events is not None:
+            self.events.append(event)
+
+    def summary(self):
+        """The counters, the last value of every series and the call count,
+        total and maximum seconds of every timer, as one JSON-ready dict."""
+
+        return {'counters': dict(self.counters),
+                'values': {name: values[-1] for name, values in self.values.items()},
+                'timers': {name: {'calls': len(t), 'seconds': sum(t), 'max_seconds': max(t)}
+                           for name, t in self.timers.items()}}
+
+
+class JSONLinesSink:
+    """Appends every event as one JSON object per line to a file, given as
+    a path or an open text file. Lines are flushed as they are written, so
+    the log survives a crash."""
+
+    def __init__(self, file):
+        self.owned = isinstance(file, str)
+        self.file = open(file, 'a', buffering=1) if self.owned else file
+
+    def emit(self, event):
+        self.file.write(json.dumps(event, default=str) + '\n')
+        if not self.owned:
+            self.file.flush()
+
+    def close(self):
+        if self.owned:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,4 +1,9 @@
+import heapq
+import json
+import os
 import random
+import numpy as np
+import instrumentation
 
 class MDP:
     """A Markov Decision Process, defined by an initial state, transition model,
@@ -34,6 +39,7 @@ class MDP:
         self.gamma = gamma
 
         self.reward = reward or {s: 0 for s in self.states}
+        self.index_transitions()
 
         #self.check_consistency()
 
@@ -61,6 +67,49 @@ class MDP:
         else:
             return self.actlist
 
+    def index_transitions(self):
+        """Build the successor and predecessor indexes of the transition
+        table: successors[s] is a tuple of the states that appear in T(s, a)
+        for any action a, in first-seen order, and predecessors[s] the tuple
+        of states that have s among their successors. Call again after
+        changing self.transitions. Transition models given as matrices
+        (see POMDP) are not indexed."""
+
+        self.successors = {}
+        self.predecessors = {}
+        if not isinstance(self.transitions, dict):
+            return
+        predecessors = {}
+        for s, actions in self.transitions.items():
+            successors = {}
+            for effects in actions.values():
+                for (p, s1) in effects:
+                    successors[s1] = None
+            self.successors[s] = tuple(successors)
+            for s1 in successors:
+                predecessors.setdefault(s1, {})[s] = None
+        self.predecessors = {s: tuple(states) for s, states in predecessors.items()}
+
+    def update_index(self, states):
+        """Patch the successor and predecessor indexes after the transitions
+        of the given states changed or were removed, touching only their
+        entries instead of rebuilding both indexes."""
+
+        for s in states:
+            for s1 in self.successors.pop(s, ()):
+                self.predecessors[s1] = tuple(p for p in self.predecessors[s1] if p != s)
+            if s in self.transitions:
+                successors = {}
+                for effects in self.transitions[s].values():
+                    for (p, s1) in effects:
+                        successors[s1] = None
+                self.successors[s] = tuple(successors)
+                for s1 in successors:
+                    self.predecessors[s1] = self.predecessors.get(s1, ()) + (s,)
+        for s in states:
+            if s not in self.transitions and not self.predecessors.get(s, True):
+                del self.predecessors[s]
+
     def get_states_from_transitions(self, transitions):
         #gets states as union from keys (initial) and effects of actions
         if isinstance(transitions, dict):
@@ -95,6 +144,43 @@ class MDP:
                     s += o[0]
                 assert abs(s - 1) < 0.001
 
+    def compile(self):
+        """Compile the transition model into a CompiledMDP: states are numbered
+        in sorted order and T(s, a) is stored as sparse rows with the
+        successors in ascending order. Terminal states
+        get no outgoing transitions, matching T(s, None) = [(0.0, s)]."""
+
+        states = sorted(self.states)
+        index = {s: i for i, s in enumerate(states)}
+        terminals = set(self.terminals or [])
+        actlist = list(self.actlist)
+
+        indptr = [0]
+        indices = []
+        data = []
+        for a in actlist:
+            for s in states:
+                if s not in terminals:
+                    successors = {}
+                    for (p, s1) in self.T(s, a):
+                        if p > 0:
+                            successors[index[s1]] = successors.get(index[s1], 0) + p
+                    # successors in index order, so that every way of building
+                    # the same model (e.g. grid_generator.compile_grid) gives
+                    # the same arrays and model_hash
+                    for j in sorted(successors):
+                        indices.append(j)
+                        data.append(successors[j])
+                indptr.append(len(indices))
+
+        return CompiledMDP(states, actlist,
+                           indptr=np.array(indptr, dtype=np.int64),
+                           indices=np.array(indices, dtype=np.int32),
+                           data=np.array(data, dtype=np.float64),
+                           rewards=np.array([self.R(s) for s in states], dtype=np.float64),
+                           terminal_mask=np.array([s in terminals for s in states], dtype=bool),
+                           gamma=self.gamma)
+
 
 class MDP2(MDP):
     """
@@ -111,6 +197,209 @@ class MDP2(MDP):
             return self.transitions[state][action]
 
 
+class CompiledMDP:
+    """An MDP compiled into flat arrays, as returned by MDP.compile().
+    States are numbered 0..n-1; states[i] maps an index back to the original
+    state and index[s] maps a state to its number. The transition model is a
+    scipy-free CSR matrix with one row per (action, state) pair: row
+    a * n + s holds the successors of s under actlist[a] in
+    indices[indptr[row]:indptr[row + 1]] with probabilities in data. Rows of
+    terminal states are empty. Matrix-vector products cost O(nnz).
+
+    states may also be given as an array with one row per state (e.g. the
+    (x, y) of grid cells); the list of states and the index are then only
+    built on first use. save() writes the model as .npy files that load()
+    memory-maps, so many processes can share one page-cached copy."""
+
+    arrays = ('indptr', 'indices', 'data', 'rewards', 'terminal_mask', 'rows')
+
+    def __init__(self, states, actlist, indptr, indices, data, rewards, terminal_mask, gamma, rows=None):
+        if isinstance(states, np.ndarray):
+            self.state_array, self._states = states, None
+        else:
+            self.state_array, self._states = None, list(states)
+        self._index = None
+        self.actlist = list(actlist)
+        self.action_index = {a: i for i, a in enumerate(self.actlist)}
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.rewards = rewards
+        self.terminal_mask = terminal_mask
+        self.gamma = gamma
+        # row number of every stored entry, for O(nnz) segment sums
+        if rows is None:
+            rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        self.rows = rows
+        self._successor_table = None
+        self._predecessor_table = None
+        self._predecessors = None
+        self._cumulative = None
+
+    @property
+    def states(self):
+        if self._states is None:
+            self._states = [tuple(s) if isinstance(s, list) else s for s in self.state_array.tolist()]
+        return self._states
+
+    @property
+    def n_states(self):
+        return len(self.rewards)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {s: i for i, s in enumerate(self.states)}
+        return self._index
+
+    def save(self, directory):
+        """Write the model to directory: one .npy file per array plus
+        meta.json with the actions, gamma and other small settings. States
+        must be numbers or tuples of numbers."""
+
+        os.makedirs(directory, exist_ok=True)
+        states = self.state_array if self.state_array is not None else np.array(self.states)
+        np.save(os.path.join(directory, 'states.npy'), states)
+        for name in self.arrays:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(self.meta(), f)
+
+    def meta(self):
+        return {'type': type(self).__name__, 'gamma': self.gamma,
+                'actlist': [list(a) if isinstance(a, tuple) else a for a in self.actlist]}
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open a model written by save. With the default mmap_mode the
+        arrays are read-only memory maps of the files, so opening is cheap
+        and the pages are shared between processes."""
+
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ('states',) + cls.arrays}
+        return cls.from_saved(meta, arrays)
+
+    @classmethod
+    def from_saved(cls, meta, arrays):
+        actlist = [tuple(a) if isinstance(a, list) else a for a in meta['actlist']]
+        return cls(arrays['states'], actlist, arrays['indptr'], arrays['indices'], arrays['data'],
+                   arrays['rewards'], arrays['terminal_mask'], meta['gamma'], rows=arrays['rows'])
+
+    def transition_matrix(self, action):
+        """Return the (indptr, indices, data) CSR arrays of T[action] alone,
+        with indptr rebased to start at 0."""
+
+        n = self.n_states
+        a = self.action_index[action]
+        indptr = self.indptr[a * n:(a + 1) * n + 1]
+        lo, hi = indptr[0], indptr[-1]
+        return indptr - lo, self.indices[lo:hi], self.data[lo:hi]
+
+    def successor_table(self):
+        """Return the transition model in a padded (ELLPACK) layout: arrays
+        successors and probabilities of shape (actions, states, width) where
+        width is the largest number of successors of any row. Padding slots
+        point at state 0 with probability 0. Lets many utility vectors be
+        pushed through T at once with a few gathers."""
+
+        if self._successor_table is None:
+            n, A = self.n_states, len(self.actlist)
+            counts = np.diff(self.indptr)
+            width = max(int(counts.max()) if len(counts) else 0, 1)
+            slots = np.arange(len(self.indices)) - self.indptr[self.rows]
+            successors = np.zeros((A * n, width), dtype=np.int64)
+            probabilities = np.zeros((A * n, width), dtype=np.float64)
+            successors[self.rows, slots] = self.indices
+            probabilities[self.rows, slots] = self.data
+            self._successor_table = (successors.reshape(A, n, width), probabilities.reshape(A, n, width))
+        return self._successor_table
+
+    def predecessor_table(self):
+        """Return the transposed transition model in a padded (ELLPACK)
+        layout: arrays predecessors and probabilities of shape (actions,
+        states, width) where predecessors[a, s'] lists the states s with
+        P(s'|s, a) > 0 and width is the largest number of them for any s'.
+        Padding slots point at state 0 with probability 0. Lets many beliefs
+        be pushed forward through T at once with a few gathers."""
+
+        if self._predecessor_table is None:
+            n, A = self.n_states, len(self.actlist)
+            # group the entries by (action, target) row of the transpose
+            targets = (self.rows // n) * n + self.indices
+            order = np.argsort(targets, kind='stable')
+            counts = np.bincount(targets, minlength=A * n)
+            width = max(int(counts.max()) if len(counts) else 0, 1)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            slots = np.arange(len(order)) - starts[targets[order]]
+            predecessors = np.zeros((A * n, width), dtype=np.int64)
+            probabilities = np.zeros((A * n, width), dtype=np.float64)
+            predecessors[targets[order], slots] = self.rows[order] % n
+            probabilities[targets[order], slots] = self.data[order]
+            self._predecessor_table = (predecessors.reshape(A, n, width), probabilities.reshape(A, n, width))
+        return self._predecessor_table
+
+    def predecessors(self):
+        """Return the predecessor index as CSR arrays (indptr, indices): the
+        states that reach state s' under some action with nonzero
+        probability are indices[indptr[s']:indptr[s' + 1]], each listed once."""
+
+        if self._predecessors is None:
+            n = self.n_states
+            pairs = np.unique(self.indices.astype(np.int64) * n + self.rows % n)
+            targets, sources = pairs // n, pairs % n
+            indptr = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=n))))
+            self._predecessors = (indptr, sources)
+        return self._predecessors
+
+    def sample_successors(self, states, actions, rng):
+        """Draw one successor for every pair of state and action index, with
+        a NumPy random generator rng. States whose row is empty (terminals)
+        stay where they are."""
+
+        if self._cumulative is None:
+            # probabilities summed up within every row
+            total = np.cumsum(self.data)
+            before = np.concatenate(([0.0], total))[self.indptr[:-1]]
+            self._cumulative = total - before[self.rows]
+        if len(self.indices) == 0:
+            return np.asarray(states).copy()
+
+        states = np.asarray(states)
+        rows = np.asarray(actions) * self.n_states + states
+        lo, hi = self.indptr[rows], self.indptr[rows + 1]
+        empty = lo == hi
+        last = np.minimum(np.maximum(hi - 1, lo), len(self.indices) - 1)
+        u = rng.random(len(rows)) * self._cumulative[last]
+        k = np.minimum(lo, len(self.indices) - 1)
+        for _ in range(int(np.diff(self.indptr).max()) - 1):
+            k += (self._cumulative[k] < u) & (k < hi - 1)
+        return np.where(empty, states, self.indices[k])
+
+    def expected_utilities(self, U):
+        """Return an (actions, states) array holding sum_s' P(s'|s, a) U[s']
+        for every state and action, for a utility vector U."""
+
+        n = self.n_states
+        values = np.bincount(self.rows, weights=self.data * U[self.indices],
+                             minlength=len(self.actlist) * n)
+        return values.reshape(len(self.actlist), n)
+
+    def propagate(self, b, action):
+        """Push a distribution over states through T[action]:
+        b'(s') = sum_s P(s'|s, a) b(s). Mass on terminal states stays put."""
+
+        n = self.n_states
+        a = self.action_index[action]
+        lo, hi = self.indptr[a * n], self.indptr[(a + 1) * n]
+        weights = self.data[lo:hi] * b[self.rows[lo:hi] - a * n]
+        b1 = np.bincount(self.indices[lo:hi], weights=weights, minlength=n)
+        b1[self.terminal_mask] += b[self.terminal_mask]
+        return b1
+
+
+@instrumentation.timed('value_iteration')
 def value_iteration(mdp, epsilon=0.001):
     """Solving an MDP by value iteration. [Figure 17.4]"""
 
@@ -123,6 +412,8 @@ def value_iteration(mdp, epsilon=0.001):
             U1[s] = R(s) + gamma * max(sum(p * U[s1] for (p, s1) in T(s, a))
                                        for a in mdp.actions(s))
             delta = max(delta, abs(U1[s] - U[s]))
+        instrumentation.count('bellman_backups', len(mdp.states))
+        instrumentation.observe('residual', delta, solver='value_iteration')
         if delta <= epsilon * (1 - gamma) / gamma:
             return U
 
@@ -146,6 +437,7 @@ def expected_utility(a, s, U, mdp):
 # ______________________________________________________________________________
 
 
+@instrumentation.timed('policy_iteration')
 def policy_iteration(mdp):
     """Solve an MDP by policy iteration [Figure 17.7]"""
 
@@ -153,13 +445,15 @@ def policy_iteration(mdp):
     pi = {s: random.choice(mdp.actions(s)) for s in mdp.states}
     while True:
         U = policy_evaluation(pi, U, mdp)
-        unchanged = True
+        changes = 0
         for s in mdp.states:
             a = max(mdp.actions(s), key=lambda a: expected_utility(a, s, U, mdp))
             if a != pi[s]:
                 pi[s] = a
-                unchanged = False
-        if unchanged:
+                changes += 1
+        instrumentation.count('bellman_backups', len(mdp.states))
+        instrumentation.observe('policy_changes', changes, solver='policy_iteration')
+        if not changes:
             return pi
 
 
@@ -171,6 +465,231 @@ def policy_evaluation(pi, U, mdp, k=20):
     for i in range(k):
         for s in mdp.states:
             U[s] = R(s) + gamma * sum(p * U[s1] for (p, s1) in T(s, pi[s]))
+    instrumentation.count('policy_evaluation_backups', k * len(mdp.states))
     return U
 
 
+
+
+# ______________________________________________________________________________
+# Array-backed versions of the algorithms above. They run on the compiled
+# model (see MDP.compile), back up all states and actions at once and return
+# the same dict utilities and policies, so best_policy and to_arrows still work.
+
+
+def _compiled(mdp):
+    return mdp if isinstance(mdp, CompiledMDP) else mdp.compile()
+
+
+@instrumentation.timed('value_iteration_vectorized')
+def value_iteration_vectorized(mdp, epsilon=0.001, U0=None):
+    """Solving an MDP by value iteration, with one Bellman backup of every
+    state and action per sweep. U0, an array over the numbered states,
+    warm-starts the sweeps, e.g. from the solution before a reward change;
+    the stopping rule bounds the error from any start. [Figure 17.4]"""
+
+    model = _compiled(mdp)
+    R, gamma = model.rewards, model.gamma
+    U1 = np.zeros(model.n_states) if U0 is None else np.array(U0, dtype=np.float64)
+    while True:
+        U = U1
+        U1 = R + gamma * model.expected_utilities(U).max(axis=0)
+        delta = np.abs(U1 - U).max()
+        instrumentation.count('bellman_backups', model.n_states)
+        instrumentation.observe('residual', delta, solver='value_iteration_vectorized')
+        if delta <= epsilon * (1 - gamma) / gamma:
+            return dict(zip(model.states, U.tolist()))
+
+
+@instrumentation.timed('policy_iteration_vectorized')
+def policy_iteration_vectorized(mdp, exact=False):
+    """Solve an MDP by policy iteration, starting from the first action in
+    every state. With exact=True every policy is evaluated to convergence
+    instead of by a fixed number of sweeps. [Figure 17.7]"""
+
+    model = _compiled(mdp)
+    n = model.n_states
+    pi = np.zeros(n, dtype=np.int64)
+    U = np.zeros(n)
+    while True:
+        U = _evaluate_policy(model, pi, U, exact=exact)
+        Q = model.expected_utilities(U)
+        best = Q.argmax(axis=0)
+        # only switch on a strict improvement, so ties cannot cycle
+        improved = Q[best, np.arange(n)] > Q[pi, np.arange(n)] + 1e-12
+        instrumentation.count('bellman_backups', n)
+        instrumentation.observe('policy_changes', improved.sum(), solver='policy_iteration_vectorized')
+        if not improved.any():
+            return {s: None if model.terminal_mask[i] else model.actlist[pi[i]]
+                    for i, s in enumerate(model.states)}
+        pi = np.where(improved, best, pi)
+
+
+def policy_evaluation_vectorized(pi, U, mdp, k=20, exact=False):
+    """Return an updated utility mapping U from each state in the MDP to its
+    utility, using k sweeps of modified policy iteration or, with
+    exact=True, the solution of U = R + gamma * T_pi U to within 1e-10."""
+
+    model = _compiled(mdp)
+    pi = np.array([model.action_index.get(pi[s], 0) for s in model.states], dtype=np.int64)
+    U = np.array([U.get(s, 0) for s in model.states], dtype=np.float64)
+    U = _evaluate_policy(model, pi, U, k=k, exact=exact)
+    return dict(zip(model.states, U.tolist()))
+
+
+def _evaluate_policy(model, pi, U, k=20, exact=False, tolerance=1e-10):
+    """Policy evaluation on arrays: pi holds an action index per state.
+    With exact=True the sweeps go on until U is within tolerance of the
+    solution of U = R + gamma * T_pi U (by the same bound as value
+    iteration), which needs only the sparse rows of pi instead of a dense
+    states x states solve."""
+
+    n = model.n_states
+    # the CSR entries of the rows chosen by pi
+    selected = np.zeros(len(model.indptr) - 1, dtype=bool)
+    selected[pi * n + np.arange(n)] = True
+    mask = selected[model.rows]
+    rows, indices, data = model.rows[mask] % n, model.indices[mask], model.data[mask]
+    if exact:
+        gamma = model.gamma
+        threshold = tolerance * (1 - gamma) / gamma if gamma < 1 else tolerance
+        sweeps = 0
+        while True:
+            U1 = model.rewards + gamma * np.bincount(rows, weights=data * U[indices], minlength=n)
+            sweeps += 1
+            delta = np.abs(U1 - U).max() if n else 0.0
+            U = U1
+            if delta <= threshold:
+                break
+        instrumentation.count('policy_evaluation_backups', sweeps * n)
+        return U
+    for i in range(k):
+        U = model.rewards + model.gamma * np.bincount(rows, weights=data * U[indices], minlength=n)
+    instrumentation.count('policy_evaluation_backups', k * n)
+    return U
+
+
+def _state_backups(model):
+    """Per-state Bellman backups as plain Python lists, which beat NumPy
+    calls on the few successors of a single state. Returns a function
+    backup(U, s) for a list of utilities U."""
+
+    n = model.n_states
+    indptr, indices, data = model.indptr.tolist(), model.indices.tolist(), model.data.tolist()
+    rows = [[list(zip(data[indptr[a * n + s]:indptr[a * n + s + 1]],
+                      indices[indptr[a * n + s]:indptr[a * n + s + 1]]))
+             for a in range(len(model.actlist))]
+            for s in range(n)]
+    R, gamma = model.rewards.tolist(), model.gamma
+
+    def backup(U, s):
+        return R[s] + gamma * max(sum(p * U[s1] for (p, s1) in row) for row in rows[s])
+
+    return backup
+
+
+@instrumentation.timed('value_iteration_gauss_seidel')
+def value_iteration_gauss_seidel(mdp, epsilon=0.001):
+    """Solving an MDP by value iteration with in-place (Gauss-Seidel)
+    sweeps: each backup already uses the utilities updated earlier in the
+    same sweep, which usually needs fewer sweeps than the synchronous
+    version."""
+
+    model = _compiled(mdp)
+    backup = _state_backups(model)
+    gamma = model.gamma
+    U = [0.0] * model.n_states
+    while True:
+        delta = 0
+        for s in range(len(U)):
+            u = backup(U, s)
+            delta = max(delta, abs(u - U[s]))
+            U[s] = u
+        instrumentation.count('bellman_backups', len(U))
+        instrumentation.observe('residual', delta, solver='value_iteration_gauss_seidel')
+        if delta <= epsilon * (1 - gamma) / gamma:
+            return dict(zip(model.states, U))
+
+
+@instrumentation.timed('value_iteration_prioritized')
+def value_iteration_prioritized(mdp, epsilon=0.001, max_backups=None):
+    """Solving an MDP by prioritized sweeping. States wait in a heap keyed
+    by their Bellman residual; the state with the largest residual is backed
+    up and only its predecessors get their residuals recomputed. States far
+    from any change are never touched again, which pays off when most
+    states converge early."""
+
+    model = _compiled(mdp)
+    backup = _state_backups(model)
+    indptr, predecessors = model.predecessors()
+    indptr, predecessors = indptr.tolist(), predecessors.tolist()
+    gamma = model.gamma
+    threshold = epsilon * (1 - gamma) / gamma
+
+    U = [0.0] * model.n_states
+    residuals = [abs(backup(U, s) - U[s]) for s in range(len(U))]
+    heap = [(-r, s) for s, r in enumerate(residuals) if r > threshold]
+    heapq.heapify(heap)
+
+    backups = recomputed = 0
+    while heap and (max_backups is None or backups < max_backups):
+        r, s = heapq.heappop(heap)
+        if -r != residuals[s]:
+            continue  # stale entry, s was re-queued with another residual
+        U[s] = backup(U, s)
+        residuals[s] = 0
+        backups += 1
+        recomputed += indptr[s + 1] - indptr[s]
+        for p in predecessors[indptr[s]:indptr[s + 1]]:
+            residual = abs(backup(U, p) - U[p])
+            if residual > threshold and residual != residuals[p]:
+                residuals[p] = residual
+                heapq.heappush(heap, (-residual, p))
+    # residual recomputations are Bellman backups that are not stored
+    instrumentation.count('bellman_backups', len(U) + backups + recomputed)
+    instrumentation.observe('residual', max(residuals), solver='value_iteration_prioritized')
+    return dict(zip(model.states, U))
+
+
+@instrumentation.timed('value_iteration_incremental')
+def value_iteration_incremental(mdp, U, changed, epsilon=0.001, max_backups=None):
+    """Re-solving an MDP after a local change, by prioritized sweeping from
+    the previous utilities U, a {state: utility} mapping. changed holds the
+    states whose reward or transitions changed or that were added or
+    removed (as returned by GridMDP.update_cells). Only they are queued at
+    first and a backup only requeues the predecessors of its state, found in
+    mdp.predecessors, so the work follows the size of the change instead of
+    the size of the MDP. New states start at 0. Returns the new utilities."""
+
+    R, T, gamma = mdp.R, mdp.T, mdp.gamma
+    threshold = epsilon * (1 - gamma) / gamma
+    U = dict(U)
+    for s in changed:
+        if s in mdp.transitions:
+            U.setdefault(s, 0.0)
+        else:
+            U.pop(s, None)
+
+    def backup(s):
+        return R(s) + gamma * max(sum(p * U[s1] for (p, s1) in T(s, a)) for a in mdp.actions(s))
+
+    residuals = {s: abs(backup(s) - U[s]) for s in changed if s in U}
+    heap = [(-r, s) for s, r in residuals.items() if r > threshold]
+    heapq.heapify(heap)
+
+    backups = recomputed = 0
+    while heap and (max_backups is None or backups < max_backups):
+        r, s = heapq.heappop(heap)
+        if -r != residuals.get(s):
+            continue  # stale entry, s was re-queued with another residual
+        U[s] = backup(s)
+        residuals[s] = 0
+        backups += 1
+        for p in mdp.predecessors.get(s, ()):
+            recomputed += 1
+            residual = abs(backup(p) - U[p])
+            if residual > threshold and residual != residuals.get(p):
+                residuals[p] = residual
+                heapq.heappush(heap, (-residual, p))
+    instrumentation.count('bellman_backups', len(changed) + backups + recomputed)
+    return U
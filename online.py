@@ -0,0 +1,220 @@
+"""
+Online belief tracking for many agents with asyncio.
+DynamicDecisionNetwork.solve_grid plans, then takes the predicted belief
+as if the action had been observed. Here every agent is a session that
+consumes real evidence from a stream: for each evidence it filters its
+belief with the last action and that evidence, plans the next action off
+the event loop in an executor and emits it. One OnlineRunner hosts any
+number of concurrent sessions on one compiled model and shares one planner,
+so beliefs that several agents reach are planned once. Planning requests
+that arrive in the same turn of the event loop are sent to the executor
+as batches, so thousands of sessions cost a few executor calls per turn
+instead of one thread handoff each.
+
+    runner = OnlineRunner(model, max_depth=2)
+    await runner.run_session('robot-1', evidence_queue, emit=action_queue)
+"""
+import asyncio
+import functools
+import inspect
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import instrumentation
+from belief import BeliefModel
+from expectimax import ExpectimaxPlanner, _plan_in_worker, worker_pool
+
+SessionStep = namedtuple('SessionStep', ['evidence', 'action', 'utility', 'seconds'])
+
+
+class AgentSession:
+    """The state of one tracked agent: its belief vector, the last action it
+    was told to do and its steps so far."""
+
+    def __init__(self, session_id, belief):
+        self.session_id = session_id
+        self.belief = belief
+        self.action = None
+        self.steps = []
+        self.done = False
+
+
+class OnlineRunner:
+    """Runs agent sessions on a CompiledPOMDP. Planning is a depth-limited
+    expectimax of max_depth; with backend='thread' it runs in a thread pool
+    sharing one planner and transposition table, with backend='process' in
+    a process pool of workers that each plan on a shared-memory copy of the
+    model (see expectimax.worker_pool). A batch holds at most max_batch
+    beliefs and a transposition table at most capacity beliefs, the least
+    recently used dropped first. Call close() when done."""
+
+    def __init__(self, model, max_depth=2, backend='thread', max_workers=None, max_batch=64,
+                 capacity=100000):
+        if backend not in ('thread', 'process'):
+            raise ValueError("backend must be 'thread' or 'process'")
+        self.model = model
+        self.belief_model = BeliefModel(model)
+        self.planner = ExpectimaxPlanner(self.belief_model, max_depth, capacity=capacity)
+        self.backend = backend
+        self.shared_memory = []
+        if backend == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self.executor, self.shared_memory = worker_pool(self.planner, max_workers)
+        self.max_batch = max_batch
+        self.pending = []
+        self.sessions = {}
+
+    def close(self):
+        self.executor.shutdown()
+        for block in self.shared_memory:
+            block.close()
+            block.unlink()
+        self.shared_memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open_session(self, session_id, belief_state=None):
+        """Start tracking an agent from a {state: probability} belief,
+        by default uniform over the non-terminal states."""
+
+        if belief_state is None:
+            b = np.where(self.model.terminal_mask, 0.0, 1.0)
+            b /= b.sum()
+        else:
+            b = self.belief_model.to_array(belief_state)
+        session = self.sessions[session_id] = AgentSession(session_id, b)
+        return session
+
+    def close_session(self, session_id):
+        return self.sessions.pop(session_id, None)
+
+    async def plan(self, b):
+        """(best action, utility) of belief vector b, computed in the
+        executor so the event loop keeps serving other sessions."""
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((b, future))
+        if len(self.pending) == 1:
+            loop.call_soon(self.dispatch, loop)
+        return await future
+
+    def dispatch(self, loop):
+        """Send the pending planning requests to the executor in batches."""
+
+        pending, self.pending = self.pending, []
+        instrumentation.count('online_planning_batches', -(-len(pending) // self.max_batch))
+        for k in range(0, len(pending), self.max_batch):
+            batch = pending[k:k + self.max_batch]
+            beliefs = [b for (b, future) in batch]
+            if self.backend == 'process':
+                result = loop.run_in_executor(self.executor, _plan_in_worker, beliefs)
+            else:
+                result = loop.run_in_executor(self.executor, self.plan_batch, beliefs)
+            result.add_done_callback(functools.partial(_resolve, [future for (b, future) in batch]))
+
+    def plan_batch(self, beliefs):
+        return [self.planner.plan(b) for b in beliefs]
+
+    def observe(self, session, evidence):
+        """Filter the belief of a session with its last action and the
+        evidence. Evidence that is impossible under the belief is ignored
+        and the predicted belief is kept instead."""
+
+        b = self.belief_model.update(session.belief, session.action, evidence)
+        if not b.any():
+            instrumentation.count('impossible_evidence')
+            b = self.belief_model.predict(session.belief, session.action)
+        session.belief = b
+
+    async def step(self, session, evidence=None):
+        """Filter with the evidence (unless this is the first step), plan
+        and return the SessionStep with the next action, which is None once
+        the belief is terminal."""
+
+        start = time.perf_counter()
+        if session.action is not None:
+            self.observe(session, evidence)
+        action, utility = await self.plan(session.belief)
+        session.action = action
+        session.done = action is None
+        step = SessionStep(evidence, action, utility, time.perf_counter() - start)
+        session.steps.append(step)
+        instrumentation.observe('online_step_seconds', step.seconds)
+        return step
+
+    async def run_session(self, session_id, evidence, emit=None, belief_state=None):
+        """Track one agent until its belief is terminal or its evidence runs
+        out. evidence is an async iterator of evidence values or an
+        asyncio.Queue, in which None ends the stream. The first action is
+        emitted before any evidence, then one after each evidence. emit is
+        an asyncio.Queue that receives (session_id, step) pairs or a
+        function, possibly async, called with session_id and step. The
+        session is closed when its stream ends. Returns the session."""
+
+        session = self.sessions.get(session_id) or self.open_session(session_id, belief_state)
+
+        async def send(step):
+            if emit is None:
+                return
+            if isinstance(emit, asyncio.Queue):
+                await emit.put((session_id, step))
+            else:
+                result = emit(session_id, step)
+                if inspect.isawaitable(result):
+                    await result
+
+        try:
+            await send(await self.step(session))
+            async for e in _stream(evidence):
+                if session.done:
+                    break
+                await send(await self.step(session, e))
+        finally:
+            self.close_session(session_id)
+        return session
+
+    async def run(self, streams, emit=None):
+        """Run a session for every (session_id, evidence stream) item of
+        streams concurrently. Returns {session_id: session}."""
+
+        sessions = await asyncio.gather(*(self.run_session(session_id, evidence, emit)
+                                          for session_id, evidence in dict(streams).items()))
+        return {session.session_id: session for session in sessions}
+
+
+def _resolve(futures, result):
+    """Hand the results, or the error, of a batch to its futures. If the
+    batch was cancelled, e.g. by an executor shutdown, so are they."""
+
+    cancelled = result.cancelled()
+    error = None if cancelled else result.exception()
+    for k, future in enumerate(futures):
+        if future.done():
+            continue
+        if cancelled:
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result.result()[k])
+
+
+async def _stream(evidence):
+    """Iterate over an async iterator, or over an asyncio.Queue up to None."""
+
+    if isinstance(evidence, asyncio.Queue):
+        while True:
+            e = await evidence.get()
+            if e is None:
+                return
+            yield e
+    else:
+        async for e in evidence:
+            yield e
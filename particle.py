@@ -0,0 +1,89 @@
+"""
+Particle-filter belief states for POMDPs.
+Instead of a probability for every state, a belief is a fixed number of
+weighted samples (particles) of the current state. A filter step moves every
+particle by sampling the transition model, weights it by the sensor model
+for the observed evidence and resamples when the weights degenerate. The
+cost of a step depends on the number of particles, not on the number of
+states, which pays off on big maps when the agent is nearly localized.
+"""
+import numpy as np
+import instrumentation
+
+
+class ParticleBelief:
+    """A belief state of a CompiledPOMDP given by particles, an array of
+    state indices, and their weights, which sum to 1. Resampling is
+    low-variance (systematic) and happens when the effective sample size
+    falls below resample_threshold times the particle count."""
+
+    def __init__(self, model, particles, weights=None, rng=None, resample_threshold=0.5):
+        self.model = model
+        self.particles = np.asarray(particles, dtype=np.int64)
+        if weights is None:
+            weights = np.full(len(self.particles), 1.0 / len(self.particles))
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.resample_threshold = resample_threshold
+
+    @classmethod
+    def from_belief_state(cls, model, belief_state, n_particles=1000, rng=None, resample_threshold=0.5):
+        """Sample particles from a {state: probability} mapping."""
+
+        rng = rng if rng is not None else np.random.default_rng()
+        b = np.zeros(model.n_states)
+        for s, p in belief_state.items():
+            b[model.index[s]] = p
+        particles = rng.choice(len(b), size=n_particles, p=b / b.sum())
+        return cls(model, particles, rng=rng, resample_threshold=resample_threshold)
+
+    def update(self, action, evidence):
+        """The particle filter: move every particle with the transition
+        model, weight it by P(evidence | state) and resample if needed.
+        Returns a new ParticleBelief. If no particle can explain the
+        evidence, the evidence is ignored."""
+
+        instrumentation.count('belief_updates', filter='particle')
+        a = self.model.action_index[action]
+        particles = self.model.sample_successors(self.particles, np.full(len(self.particles), a), self.rng)
+        weights = self.weights * self.model.evidence_likelihood(evidence)[particles]
+        total = weights.sum()
+        weights = weights / total if total > 0 else self.weights.copy()
+
+        belief = ParticleBelief(self.model, particles, weights, self.rng, self.resample_threshold)
+        if 1.0 / (weights ** 2).sum() < self.resample_threshold * len(particles):
+            belief.resample()
+            instrumentation.count('particle_resamples')
+        return belief
+
+    def resample(self):
+        """Low-variance resampling: one random offset, then particles are
+        picked at evenly spaced points of the cumulative weights."""
+
+        n = len(self.particles)
+        positions = (self.rng.random() + np.arange(n)) / n
+        cumulative = np.cumsum(self.weights)
+        cumulative[-1] = 1.0
+        self.particles = self.particles[np.searchsorted(cumulative, positions)]
+        self.weights = np.full(n, 1.0 / n)
+
+    def to_array(self):
+        """The belief as a probability vector over all states."""
+
+        return np.bincount(self.particles, weights=self.weights, minlength=self.model.n_states)
+
+    def to_belief_state(self):
+        """The belief as a {state: probability} mapping of the occupied states."""
+
+        b = self.to_array()
+        return {self.model.states[i]: b[i] for i in np.nonzero(b)[0].tolist()}
+
+    def get_belief_state_reward(self):
+        """Get the expected reward of the belief."""
+
+        return float(self.weights @ self.model.rewards[self.particles])
+
+    def reached_terminal_state(self):
+        """Check if all weight is on terminal states."""
+
+        return float(self.weights @ self.model.terminal_mask[self.particles]) >= 1 - 1e-9
@@ -0,0 +1,87 @@
+"""
+Alpha-vector policies for POMDPs.
+A solved POMDP is a set of alpha vectors, each labelled with the action of
+its conditional plan. The value of a belief b is max_k alpha_k . b and the
+best action is the label of the maximizing vector. Here the vectors are kept
+as one contiguous (K, states) float64 matrix with a K-element array of
+action indices, so a lookup is one matrix-vector product and one argmax.
+Policies are stored as .npy files that can be memory-mapped, so several
+serving processes share one page-cached copy.
+"""
+import os
+import numpy as np
+
+
+class AlphaVectorPolicy:
+    """A POMDP policy given by alpha vectors. alphas is a (K, states) array
+    over the numbered states, actions the K indices of their actions in
+    actlist, and states the state of every column."""
+
+    def __init__(self, alphas, actions, actlist, states):
+        self.alphas = np.ascontiguousarray(alphas, dtype=np.float64)
+        self.actions = np.ascontiguousarray(actions, dtype=np.int64)
+        self.actlist = list(actlist)
+        self.states = list(states)
+        self.index = {s: i for i, s in enumerate(self.states)}
+
+    @classmethod
+    def from_mapping(cls, mapping, actlist, states):
+        """Build a policy from the {action: [alpha vectors]} mapping returned
+        by pomdp_value_iteration."""
+
+        actlist = list(actlist)
+        alphas, actions = [], []
+        for action, vectors in mapping.items():
+            for vector in vectors:
+                alphas.append(np.ravel(vector))
+                actions.append(actlist.index(action))
+        return cls(np.array(alphas), np.array(actions), actlist, states)
+
+    def to_array(self, belief_state):
+        """Convert a {state: probability} mapping into a belief vector."""
+
+        b = np.zeros(len(self.states), dtype=np.float64)
+        for s, p in belief_state.items():
+            b[self.index[s]] = p
+        return b
+
+    def value(self, b):
+        """The value max_k alpha_k . b of a belief vector."""
+
+        return float((self.alphas @ b).max())
+
+    def best_action(self, b):
+        """The best action for a belief vector."""
+
+        return self.actlist[self.actions[np.argmax(self.alphas @ b)]]
+
+    def best_actions(self, B):
+        """The best actions for an (N, states) array of beliefs, as N
+        indices into actlist."""
+
+        return self.actions[np.argmax(B @ self.alphas.T, axis=1)]
+
+    def save(self, directory):
+        """Write the policy to directory as .npy files."""
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'alphas.npy'), self.alphas)
+        np.save(os.path.join(directory, 'actions.npy'), self.actions)
+        np.save(os.path.join(directory, 'actlist.npy'), np.array(self.actlist))
+        np.save(os.path.join(directory, 'states.npy'), np.array(self.states))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Read a policy written by save. With the default mmap_mode the
+        alpha vectors are memory-mapped read-only instead of copied."""
+
+        def restore(values):
+            return [tuple(v) if isinstance(v, list) else v for v in values.tolist()]
+
+        policy = cls.__new__(cls)
+        policy.alphas = np.load(os.path.join(directory, 'alphas.npy'), mmap_mode=mmap_mode)
+        policy.actions = np.load(os.path.join(directory, 'actions.npy'))
+        policy.actlist = restore(np.load(os.path.join(directory, 'actlist.npy')))
+        policy.states = restore(np.load(os.path.join(directory, 'states.npy')))
+        policy.index = {s: i for i, s in enumerate(policy.states)}
+        return policy
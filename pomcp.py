@@ -0,0 +1,242 @@
+"""
+Partially Observable Monte Carlo Planning (POMCP).
+An anytime online planner for POMDPs: from the current belief, given as
+particles, it runs simulations with a generative model of the POMDP until a
+wall-clock budget is spent, growing a search tree over action/evidence
+histories with UCB action selection and random rollouts below the tree.
+The deadline is checked at every simulated step, so a search overruns its
+budget by at most one step; a simulation cut short is discarded.
+Every history node keeps the particles that reached it, so after the real
+action and evidence the matching subtree becomes the new root and the
+search continues where it left off.
+"""
+import bisect
+import math
+import random
+import time
+import instrumentation
+
+
+class HistoryNode:
+    """A node for an action/evidence history, with the states (particles)
+    that simulations reached it in and one ActionNode per tried action."""
+
+    def __init__(self):
+        self.visits = 0
+        self.particles = []
+        self.children = {}
+
+
+class ActionNode:
+    """A node for doing an action after a history, with the mean return of
+    the simulations through it and one HistoryNode per evidence seen."""
+
+    def __init__(self):
+        self.visits = 0
+        self.value = 0.0
+        self.children = {}
+
+
+class POMCP:
+    """POMCP planner on a CompiledPOMDP. The initial belief is a
+    {state: probability} mapping (uniform over non-terminal states by
+    default), represented by n_particles particles. Simulations are at most
+    max_depth steps deep and exploration is the UCB constant. Per-(state,
+    action) sampling tables are built on first use, so the cost of a
+    decision depends on the time budget and not on the number of states."""
+
+    def __init__(self, model, belief_state=None, n_particles=1000, max_depth=50, exploration=1.0, seed=None):
+        self.model = model
+        self.n_particles = n_particles
+        self.max_depth = max_depth
+        self.exploration = exploration
+        self.gamma = model.gamma
+        self.random = random.Random(seed)
+        self.rewards = model.rewards.tolist()
+        self.terminal = model.terminal_mask.tolist()
+        self.transition_tables = {}
+        self.evidence_tables = {}
+
+        if belief_state is None:
+            states = [s for s in model.states if not self.terminal[model.index[s]]]
+            belief_state = {s: 1 / len(states) for s in states}
+        states = [model.index[s] for s in belief_state]
+        weights = list(belief_state.values())
+        self.root = HistoryNode()
+        self.root.particles = self.random.choices(states, weights, k=n_particles)
+
+    # Generative model -------------------------------------------------------
+
+    def sample_successor(self, s, a):
+        """Sample s' from P(s'|s, a) with a cached cumulative table."""
+
+        table = self.transition_tables.get((s, a))
+        if table is None:
+            row = a * self.model.n_states + s
+            lo, hi = int(self.model.indptr[row]), int(self.model.indptr[row + 1])
+            cumulative = [sum(self.model.data[lo:k + 1].tolist()) for k in range(lo, hi)]
+            table = (cumulative, self.model.indices[lo:hi].tolist())
+            self.transition_tables[(s, a)] = table
+        cumulative, successors = table
+        if not successors:
+            return s
+        k = bisect.bisect_left(cumulative, self.random.random() * cumulative[-1])
+        return successors[min(k, len(successors) - 1)]
+
+    def evidence_table(self, s):
+        cumulative = self.evidence_tables.get(s)
+        if cumulative is None:
+            cumulative = self.model.sensor[:, s].cumsum().tolist()
+            self.evidence_tables[s] = cumulative
+        return cumulative
+
+    def sample_evidence(self, s):
+        """Sample an evidence index from P(e|s) with a cached cumulative table."""
+
+        cumulative = self.evidence_table(s)
+        k = bisect.bisect_left(cumulative, self.random.random() * cumulative[-1])
+        return min(k, len(cumulative) - 1)
+
+    def evidence_likelihood(self, s, e):
+        """P(e|s) for state index s and evidence index e."""
+
+        cumulative = self.evidence_table(s)
+        return (cumulative[e] - (cumulative[e - 1] if e else 0.0)) / cumulative[-1]
+
+    def step(self, s, a):
+        """Generative model: (successor, evidence index, reward) for doing
+        action index a in state index s."""
+
+        s1 = self.sample_successor(s, a)
+        return s1, self.sample_evidence(s1), self.rewards[s1]
+
+    # Search -----------------------------------------------------------------
+
+    @instrumentation.timed('pomcp_search')
+    def search(self, time_budget=0.01):
+        """Run simulations from the root until time_budget seconds have
+        passed. Returns the number of simulations run."""
+
+        deadline = time.perf_counter() + time_budget
+        simulations = 0
+        while time.perf_counter() < deadline and self.root.particles:
+            s = self.random.choice(self.root.particles)
+            if self.simulate(s, self.root, 0, deadline) is None:
+                break
+            simulations += 1
+        instrumentation.count('pomcp_simulations', simulations)
+        return simulations
+
+    def plan(self, time_budget=0.01):
+        """Search for time_budget seconds and return the best action."""
+
+        self.search(time_budget)
+        return self.best_action()
+
+    def best_action(self):
+        """The action with the highest mean return at the root, or None if
+        nothing has been simulated."""
+
+        visited = [a for a, child in self.root.children.items() if child.visits]
+        if not visited:
+            return None
+        a = max(visited, key=lambda a: self.root.children[a].value)
+        return self.model.actlist[a]
+
+    def simulate(self, s, node, depth, deadline=math.inf):
+        """Simulate from state index s at a history node and return the
+        discounted return, or None if the deadline passed first, in which
+        case no statistics are updated."""
+
+        if self.terminal[s] or depth >= self.max_depth:
+            return 0.0
+        if time.perf_counter() >= deadline:
+            return None
+        a = self.select_action(node)
+        s1, e, r = self.step(s, a)
+
+        # new nodes are attached only once their simulation completes
+        child = node.children.get(a) or ActionNode()
+        history = child.children.get(e)
+        if history is None:
+            history = HistoryNode()
+            future = self.rollout(s1, depth + 1, deadline)
+        else:
+            future = self.simulate(s1, history, depth + 1, deadline)
+        if future is None:
+            return None
+        node.children[a] = child
+        child.children[e] = history
+        if len(history.particles) < self.n_particles:
+            history.particles.append(s1)
+        total = r + self.gamma * future
+
+        node.visits += 1
+        child.visits += 1
+        child.value += (total - child.value) / child.visits
+        return total
+
+    def select_action(self, node):
+        """UCB1 over the actions of a history node; untried actions first."""
+
+        for a in range(len(self.model.actlist)):
+            if a not in node.children:
+                return a
+        log_visits = math.log(node.visits + 1)
+        return max(node.children, key=lambda a: node.children[a].value + self.exploration *
+                   math.sqrt(log_visits / (node.children[a].visits + 1)))
+
+    def rollout(self, s, depth, deadline=math.inf):
+        """Return of a random policy from s down to max_depth, or None if
+        the deadline passes first."""
+
+        total, discount = 0.0, 1.0
+        while not self.terminal[s] and depth < self.max_depth:
+            if time.perf_counter() >= deadline:
+                return None
+            s, e, r = self.step(s, self.random.randrange(len(self.model.actlist)))
+            total += discount * r
+            discount *= self.gamma
+            depth += 1
+        return total
+
+    # Tree reuse -------------------------------------------------------------
+
+    def update(self, action, evidence, time_budget=None, max_samples=None):
+        """Move the root to the history after the real action and evidence
+        value, keeping its subtree. If that history holds too few particles
+        it is topped up by simulating the old root's particles and keeping
+        the ones that produce the same evidence, for at most max_samples
+        tries (10 * n_particles by default) and time_budget seconds. What is
+        still missing then is reinvigorated by resampling the successors
+        drawn so far in proportion to the likelihood of the evidence. It
+        adds at most a quarter as many particles as were drawn, so it costs
+        a few percent of the budget; the new root may hold fewer than
+        n_particles particles."""
+
+        a = self.model.action_index[action]
+        e = self.model.evidence_index[evidence]
+        old_root = self.root
+        child = old_root.children.get(a)
+        self.root = child.children.get(e) if child is not None else None
+        if self.root is None:
+            self.root = HistoryNode()
+
+        if max_samples is None:
+            max_samples = 10 * self.n_particles
+        deadline = math.inf if time_budget is None else time.perf_counter() + time_budget
+        drawn, weights = [], []
+        while len(self.root.particles) < self.n_particles and old_root.particles \
+                and len(drawn) < max_samples and (len(drawn) % 16 or time.perf_counter() < deadline):
+            s1 = self.sample_successor(self.random.choice(old_root.particles), a)
+            drawn.append(s1)
+            weights.append(self.evidence_likelihood(s1, e))
+            if self.sample_evidence(s1) == e:
+                self.root.particles.append(s1)
+
+        missing = min(self.n_particles - len(self.root.particles), len(drawn) // 4)
+        if missing > 0 and sum(weights) > 0:
+            instrumentation.count('pomcp_reinvigorated', missing)
+            self.root.particles.extend(self.random.choices(drawn, weights, k=missing))
+        if not self.root.particles:
+            raise ValueError("No particle is consistent with evidence %s after action %s" % (evidence, action))
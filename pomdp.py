@@ -8,7 +8,8 @@ and policy_iteration algorithms.
 """
 import random
 import numpy as np
-from mdp import MDP
+from collections import defaultdict
+from mdp import MDP, CompiledMDP
 
 class POMDP(MDP):
     """A Partially Observable Markov Decision Process, defined by
@@ -39,21 +40,43 @@ class POMDP(MDP):
 
         self.gamma = gamma
         self.rewards = rewards
+        self.index_transitions()
         self.terminals = terminals
         self.current_state = init if init != None else random.choice(states - set(terminals))
         print("State: "+ str(self.current_state))
 
+    def R(self, state):
+        """Return a numeric reward for this state."""
+
+        return self.rewards[state]
+
+    def compile(self):
+        """Compile the transition and sensor models into a CompiledPOMDP.
+        See MDP.compile."""
+
+        mdp = MDP.compile(self)
+        evidence_values = sorted({e for s in mdp.states for (p, e) in self.evidences[s]})
+        evidence_index = {e: i for i, e in enumerate(evidence_values)}
+        sensor = np.zeros((len(evidence_values), len(mdp.states)), dtype=np.float64)
+        for i, s in enumerate(mdp.states):
+            for (p, e) in self.evidences[s]:
+                sensor[evidence_index[e], i] += p
+
+        return CompiledPOMDP(mdp.states, mdp.actlist, mdp.indptr, mdp.indices, mdp.data,
+                             mdp.rewards, mdp.terminal_mask, mdp.gamma,
+                             sensor=sensor, evidence_values=evidence_values)
+
     def get_evidence(self, state):
         prop = random.random()
         evidence_value = 0.0
         i = 0
-        self.evidences[state].sort(reverse=True)
+        evidences = sorted(self.evidences[state], reverse=True)
         while True:
-            evidence_value += self.evidences[state][i][0]
+            evidence_value += evidences[i][0]
             if prop <= evidence_value:
                 break
             i += 1
-        return self.evidences[state][i][1]
+        return evidences[i][1]
 
     def current_state_is_terminal(self):
         return self.current_state in self.terminals
@@ -129,6 +152,25 @@ class POMDP(MDP):
 
         return self.generate_mapping(best, input_values)
 
+    def remove_dominated_plans_nd(self, input_values, beliefs=None):
+        """
+        Remove dominated plans for any number of states.
+        Drops vectors that are pointwise dominated by another vector and,
+        if a belief sample is given, vectors that are not the maximum at
+        any belief of the sample or at any single state.
+        """
+
+        actions = [action for action in input_values for val in input_values[action]]
+        alphas = np.array([np.ravel(val) for action in input_values for val in input_values[action]], dtype=np.float64)
+        keep = prune_pointwise_dominated(alphas)
+        if beliefs is not None:
+            keep = keep[prune_by_witness(alphas[keep], beliefs)]
+
+        mapping = defaultdict(list)
+        for k in keep:
+            mapping[actions[k]].append(alphas[k])
+        return mapping
+
     def generate_mapping(self, best, input_values):
         """Generate mappings after removing dominated plans"""
 
@@ -153,6 +195,79 @@ class POMDP(MDP):
         return abs(sum1 - sum2)
 
 
+def prune_pointwise_dominated(alphas, max_elements=2 ** 22):
+    """Return the sorted indices of the rows of a (K, states) array of alpha
+    vectors that are not pointwise dominated: no other vector is >= in every
+    state and > in one. Of identical vectors only the first is kept. Exact
+    for any number of states. A block of rows is compared against all rows
+    one tile of states at a time, with blocks and tiles sized so that no
+    temporary holds more than about max_elements entries."""
+
+    alphas = np.asarray(alphas, dtype=np.float64)
+    K, n = alphas.shape
+    dominated = np.zeros(K, dtype=bool)
+    tile = max(1, min(n, max_elements // max(K, 1)))
+    chunk = max(1, max_elements // (max(K, 1) * tile))
+    for lo in range(0, K, chunk):
+        rows = alphas[lo:lo + chunk]
+        # ge[i, j]: vector j is >= vector lo + i in every state so far,
+        # gt[i, j]: vector j is > vector lo + i in some state so far
+        ge = np.ones((len(rows), K), dtype=bool)
+        gt = np.zeros((len(rows), K), dtype=bool)
+        for start in range(0, n, tile):
+            a, r = alphas[None, :, start:start + tile], rows[:, None, start:start + tile]
+            ge &= (a >= r).all(axis=2)
+            gt |= (a > r).any(axis=2)
+        equal = ge & ~gt
+        earlier = np.arange(K)[None, :] < np.arange(lo, lo + len(rows))[:, None]
+        dominated[lo:lo + len(rows)] = (ge & gt).any(axis=1) | (equal & earlier).any(axis=1)
+    return np.nonzero(~dominated)[0]
+
+
+def prune_by_witness(alphas, beliefs):
+    """Return the sorted indices of the alpha vectors that are the maximum at
+    some witness point: a belief of the (N, states) sample or a belief that
+    is certain of one state."""
+
+    alphas = np.asarray(alphas, dtype=np.float64)
+    beliefs = np.asarray(beliefs, dtype=np.float64)
+    # at the belief certain of state s the best vector is argmax_k alphas[k, s]
+    return np.unique(np.concatenate([np.argmax(beliefs @ alphas.T, axis=1), alphas.argmax(axis=0)]))
+
+
+class CompiledPOMDP(CompiledMDP):
+    """A POMDP compiled into flat arrays, as returned by POMDP.compile().
+    Adds the sensor model to CompiledMDP as a dense (evidences, states)
+    matrix with sensor[i, s] = P(evidence_values[i] | s). Evidence is keyed
+    on its value, not on its position in the evidence lists."""
+
+    arrays = CompiledMDP.arrays + ('sensor',)
+
+    def __init__(self, states, actlist, indptr, indices, data, rewards, terminal_mask, gamma,
+                 sensor, evidence_values, rows=None):
+        CompiledMDP.__init__(self, states, actlist, indptr, indices, data, rewards, terminal_mask, gamma, rows)
+        self.sensor = sensor
+        self.evidence_values = list(evidence_values)
+        self.evidence_index = {e: i for i, e in enumerate(self.evidence_values)}
+
+    def meta(self):
+        meta = CompiledMDP.meta(self)
+        meta['evidence_values'] = self.evidence_values
+        return meta
+
+    @classmethod
+    def from_saved(cls, meta, arrays):
+        actlist = [tuple(a) if isinstance(a, list) else a for a in meta['actlist']]
+        return cls(arrays['states'], actlist, arrays['indptr'], arrays['indices'], arrays['data'],
+                   arrays['rewards'], arrays['terminal_mask'], meta['gamma'],
+                   sensor=arrays['sensor'], evidence_values=meta['evidence_values'], rows=arrays['rows'])
+
+    def evidence_likelihood(self, evidence):
+        """Return the vector P(evidence | s) over all states."""
+
+        return self.sensor[self.evidence_index[evidence]]
+
+
 
 
 
@@ -0,0 +1,76 @@
+"""
+Batched generative simulation of compiled MDPs and POMDPs.
+POMDP.act and POMDP.get_evidence draw one sample at a time with a
+cumulative while-loop. The Simulator precomputes cumulative probability
+arrays once, per (state, action) row of the transition model and per state
+for the sensor model, and advances thousands of environments at once with a
+seedable NumPy random generator.
+"""
+import numpy as np
+
+
+class Simulator:
+    """Generative model of a CompiledMDP or CompiledPOMDP. States, actions
+    and evidence are indices into model.states, model.actlist and
+    model.evidence_values."""
+
+    def __init__(self, model):
+        self.model = model
+        sensor = getattr(model, 'sensor', None)
+        # evidence_cumulative[s, i] = P(evidence index <= i | s)
+        self.evidence_cumulative = None if sensor is None else np.ascontiguousarray(sensor.T.cumsum(axis=1))
+
+    def reset(self, n, rng, belief=None):
+        """Draw n start states from a belief vector, by default uniform over
+        the non-terminal states."""
+
+        if belief is None:
+            belief = np.where(self.model.terminal_mask, 0.0, 1.0)
+        return rng.choice(len(belief), size=n, p=belief / belief.sum())
+
+    def sample_evidence(self, states, rng):
+        """Draw one evidence index for every state."""
+
+        cumulative = self.evidence_cumulative[states]
+        u = rng.random(len(states)) * cumulative[:, -1]
+        return np.minimum((cumulative < u[:, None]).sum(axis=1), cumulative.shape[1] - 1)
+
+    def step(self, states, actions, rng):
+        """Advance every environment by one action. Returns the next states,
+        their rewards, whether they are terminal and, for POMDPs, the
+        evidence indices (None for MDPs). Terminal states stay put."""
+
+        next_states = self.model.sample_successors(states, actions, rng)
+        evidence = None if self.evidence_cumulative is None else self.sample_evidence(next_states, rng)
+        return next_states, self.model.rewards[next_states], self.model.terminal_mask[next_states], evidence
+
+    def evaluate_policy(self, policy, n_episodes, rng, horizon=100, belief=None):
+        """Monte Carlo policy evaluation of a fully observable policy: run
+        n_episodes environments for at most horizon steps and return the
+        discounted return of every episode, counting the start state's
+        reward. policy is an array with an action index per state or a
+        function from an array of states to an array of action indices."""
+
+        if not callable(policy):
+            table = np.asarray(policy)
+            policy = lambda states: table[states]
+
+        states = self.reset(n_episodes, rng, belief)
+        returns = self.model.rewards[states].copy()
+        done = self.model.terminal_mask[states].copy()
+        discount = 1.0
+        for _ in range(horizon):
+            if done.all():
+                break
+            discount *= self.model.gamma
+            states, rewards, terminal, _ = self.step(states, policy(states), rng)
+            returns += np.where(done, 0.0, discount * rewards)
+            done |= terminal
+        return returns
+
+
+def policy_array(model, pi):
+    """Convert a {state: action} policy into an array of action indices;
+    states without an action (terminals) get index 0."""
+
+    return np.array([model.action_index.get(pi.get(s), 0) for s in model.states], dtype=np.int64)
@@ -0,0 +1,187 @@
+"""
+Persistent cache of MDP and POMDP solutions.
+Solving the same grid again after a restart repeats all the sweeps. A
+SolutionCache stores utilities, policies and alpha vectors on local disk,
+keyed by a content hash of the compiled model together with gamma, epsilon
+and the solver, and answers a repeated solve by reading one small file.
+Entries are .npz files; reading one marks it as used, and when the
+directory grows past max_bytes the least recently used entries are removed.
+
+Value iteration also keeps the utilities of the last solve of every
+transition structure (the model without its rewards), so after a change of
+rewards only, the new solve is warm-started from the old utilities.
+"""
+import hashlib
+import os
+import tempfile
+from collections import defaultdict
+import numpy as np
+
+from grid_pomdp import pomdp_value_iteration
+from mdp import _compiled, policy_iteration_vectorized, value_iteration_vectorized
+
+
+def model_hash(model, *params, rewards=True):
+    """SHA-256 of the content of a CompiledMDP or CompiledPOMDP (states,
+    actions, transition and sensor arrays, gamma) and of params. With
+    rewards=False the rewards are left out, which identifies the transition
+    structure."""
+
+    h = hashlib.sha256()
+    h.update(repr((type(model).__name__, model.actlist, model.gamma,
+                   getattr(model, 'evidence_values', None), params)).encode())
+    states = model.state_array if model.state_array is not None else np.array(model.states)
+    names = ('states',) + tuple(name for name in model.arrays if name != 'rows')
+    for name in names:
+        if name == 'rewards' and not rewards:
+            continue
+        array = np.ascontiguousarray(states if name == 'states' else getattr(model, name))
+        h.update(('%s%s%s' % (name, array.dtype.str, array.shape)).encode())
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+
+class SolutionCache:
+    """Solutions on disk in directory, at most max_bytes of them. The
+    methods take the same arguments as the solvers in mdp.py and grid_pomdp.py
+    and return the same dicts."""
+
+    def __init__(self, directory, max_bytes=256 * 2 ** 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # Storage ----------------------------------------------------------------
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """The arrays stored under key, or None. A hit counts as a use."""
+
+        try:
+            with np.load(self.path(key)) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+            os.utime(self.path(key))
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        return arrays
+
+    def put(self, key, **arrays):
+        """Store arrays under key, then evict down to max_bytes. The file is
+        written under a temporary name and renamed, so concurrent readers
+        never see a partial entry."""
+
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits."""
+
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
+
+    def lookup(self, key):
+        arrays = self.get(key)
+        if arrays is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return arrays
+
+    # Solvers ----------------------------------------------------------------
+
+    def value_iteration(self, mdp, epsilon=0.001):
+        """Cached value iteration; returns {state: utility}. On a miss the
+        sweeps start from the utilities of the last solve of a model with
+        the same transitions, if there is one."""
+
+        model = _compiled(mdp)
+        key = model_hash(model, 'value_iteration', epsilon)
+        arrays = self.lookup(key)
+        if arrays is None:
+            warm_key = model_hash(model, 'warm_start', rewards=False)
+            warm = self.get(warm_key)
+            U = value_iteration_vectorized(model, epsilon, U0=None if warm is None else warm['U'])
+            arrays = {'U': np.array([U[s] for s in model.states])}
+            self.put(key, **arrays)
+            self.put(warm_key, **arrays)
+        return dict(zip(model.states, arrays['U'].tolist()))
+
+    def policy_iteration(self, mdp):
+        """Cached policy iteration; returns {state: action}."""
+
+        model = _compiled(mdp)
+        key = model_hash(model, 'policy_iteration')
+        arrays = self.lookup(key)
+        if arrays is None:
+            pi = policy_iteration_vectorized(model)
+            arrays = {'pi': self._encode_policy(model, pi)}
+            self.put(key, **arrays)
+        return self._decode_policy(model, arrays['pi'])
+
+    def best_policy(self, mdp, U):
+        """Cached best_policy for the utilities U; returns {state: action}."""
+
+        model = _compiled(mdp)
+        utilities = np.array([U[s] for s in model.states], dtype=np.float64)
+        key = model_hash(model, 'best_policy', hashlib.sha256(utilities.tobytes()).hexdigest())
+        arrays = self.lookup(key)
+        if arrays is None:
+            best = model.expected_utilities(utilities).argmax(axis=0)
+            arrays = {'pi': np.where(model.terminal_mask, -1, best)}
+            self.put(key, **arrays)
+        return self._decode_policy(model, arrays['pi'])
+
+    def pomdp_value_iteration(self, pomdp, epsilon=0.1):
+        """Cached grid_pomdp.pomdp_value_iteration; returns the same
+        {action: [alpha vectors]} mapping. That solver works on the
+        transition and sensor matrices, so those are what is hashed."""
+
+        h = hashlib.sha256(repr((pomdp.actlist, pomdp.transitions, pomdp.evidences,
+                                 pomdp.rewards, pomdp.gamma, epsilon)).encode())
+        key = 'pomdp_value_iteration-' + h.hexdigest()
+        arrays = self.lookup(key)
+        if arrays is None:
+            U = pomdp_value_iteration(pomdp, epsilon)
+            actlist = list(pomdp.actlist)
+            alphas = [np.ravel(vector) for action in U for vector in U[action]]
+            arrays = {'alphas': np.array(alphas, dtype=np.float64),
+                      'actions': np.array([actlist.index(action) for action in U for vector in U[action]])}
+            self.put(key, **arrays)
+        U = defaultdict(list)
+        for a, alpha in zip(arrays['actions'].tolist(), arrays['alphas'].tolist()):
+            U[pomdp.actlist[a]].append(alpha)
+        return U
+
+    @staticmethod
+    def _encode_policy(model, pi):
+        return np.array([-1 if pi.get(s) is None else model.action_index[pi[s]] for s in model.states])
+
+    @staticmethod
+    def _decode_policy(model, pi):
+        return {s: None if a < 0 else model.actlist[a] for s, a in zip(model.states, pi.tolist())}
@@ -0,0 +1,20 @@
+import contextlib
+import io
+
+from ddn import DynamicDecisionNetwork
+
+
+def solve(**kwargs):
+    with contextlib.redirect_stdout(io.StringIO()), DynamicDecisionNetwork(2, **kwargs) as ddn:
+        return [step.action for step in ddn.solve_grid(max_steps=5)]
+
+
+def test_process_backend_plans_like_serial():
+    assert solve(execution_backend='process', max_workers=2) == solve()
+
+
+def test_close_releases_the_pool():
+    with contextlib.redirect_stdout(io.StringIO()):
+        with DynamicDecisionNetwork(2, execution_backend='process', max_workers=1) as ddn:
+            ddn.get_executor()
+    assert ddn.executor is None and ddn.shared_memory == []
@@ -0,0 +1,31 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from grid_generator import compile_grid, generate_grid, to_nested_list
+from grid_mdp import GridMDP
+from grid_pomdp import GridPOMDP
+from solution_cache import model_hash
+
+
+@pytest.mark.parametrize('kind', ['random', 'maze', 'rooms'])
+def test_compile_grid_matches_grid_mdp(kind):
+    rewards, terminals = generate_grid(12, 9, kind, seed=3)
+    expected = GridMDP(to_nested_list(rewards), terminals=terminals).compile()
+    actual = compile_grid(rewards, terminals)
+    assert actual.states == expected.states
+    for name in ('indptr', 'indices', 'data', 'rewards', 'terminal_mask'):
+        np.testing.assert_array_equal(getattr(actual, name), getattr(expected, name))
+    assert model_hash(actual) == model_hash(expected)
+
+
+def test_compile_grid_matches_grid_pomdp():
+    rewards, terminals = generate_grid(10, 10, seed=5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pomdp = GridPOMDP(to_nested_list(rewards), terminals=terminals, init=(0, 0))
+    expected = pomdp.compile()
+    actual = compile_grid(rewards, terminals, perception_failure=pomdp.perception_failure)
+    np.testing.assert_array_equal(actual.sensor, expected.sensor)
+    assert model_hash(actual) == model_hash(expected)
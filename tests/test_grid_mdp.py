@@ -0,0 +1,67 @@
+import contextlib
+import io
+
+import numpy as np
+
+import mdp
+from grid_mdp import GridMDP
+from grid_pomdp import GridPOMDP
+
+r = -0.04
+changes = {(1, 1): -0.1, (2, 0): None, (0, 2): -0.5}
+terminals = [(3, 2), (3, 1)]
+
+
+def grid():
+    return [[r, r, r, +1],
+            [r, None, r, -1],
+            [r, r, r, r]]
+
+
+def edited_grid():
+    rows = grid()
+    rows.reverse()
+    for (x, y), reward in changes.items():
+        rows[y][x] = reward
+    rows.reverse()
+    return rows
+
+
+def assert_same_model(patched, rebuilt):
+    assert patched.states == rebuilt.states
+    assert patched.transitions == rebuilt.transitions
+    assert {s: set(p) for s, p in patched.predecessors.items()} == \
+        {s: set(p) for s, p in rebuilt.predecessors.items()}
+    assert {s: set(p) for s, p in patched.successors.items()} == \
+        {s: set(p) for s, p in rebuilt.successors.items()}
+    for name in ('indptr', 'indices', 'data', 'rewards', 'terminal_mask'):
+        np.testing.assert_array_equal(getattr(patched.compile(), name), getattr(rebuilt.compile(), name))
+
+
+def test_update_cells_equals_rebuild():
+    patched = GridMDP(grid(), terminals=terminals)
+    changed = patched.update_cells(changes, terminals=[(3, 2)])
+    rebuilt = GridMDP(edited_grid(), terminals=[(3, 2)])
+    assert_same_model(patched, rebuilt)
+    assert set(changes) | {(3, 1)} <= changed
+
+
+def test_grid_pomdp_update_cells_equals_rebuild():
+    with contextlib.redirect_stdout(io.StringIO()):
+        patched = GridPOMDP(grid(), terminals=terminals, init=(0, 0))
+        patched.update_cells(changes)
+        rebuilt = GridPOMDP(edited_grid(), terminals=terminals, init=(0, 0))
+    assert_same_model(patched, rebuilt)
+    assert patched.evidences == rebuilt.evidences
+    np.testing.assert_array_equal(patched.compile().sensor, rebuilt.compile().sensor)
+
+
+def test_value_iteration_incremental():
+    environment = GridMDP(grid(), terminals=terminals)
+    U = mdp.value_iteration(environment, 1e-6)
+    changed = environment.update_cells(changes)
+    U1 = mdp.value_iteration_incremental(environment, U, changed, 1e-6)
+    expected = mdp.value_iteration(GridMDP(edited_grid(), terminals=terminals), 1e-6)
+    assert set(U1) == set(expected)
+    for s in expected:
+        assert abs(U1[s] - expected[s]) < 1e-5
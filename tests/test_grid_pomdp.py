@@ -0,0 +1,43 @@
+import contextlib
+import io
+
+import numpy as np
+
+from grid_pomdp import (GridPOMDP, backup_projections, lower_bound, point_based_backup,
+                        point_based_value_iteration, sample_beliefs)
+
+r = -0.04
+
+
+def make_pomdp():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return GridPOMDP([[r, r, r, +1],
+                          [r, None, r, -1],
+                          [r, r, r, r]],
+                         terminals=[(3, 2), (3, 1)], init=(0, 0))
+
+
+def test_backup_with_shared_projections():
+    model = make_pomdp().compile()
+    rng = np.random.default_rng(0)
+    alphas = rng.random((5, model.n_states)) - 0.5
+    beliefs = sample_beliefs(model, 20, seed=0)
+    g = backup_projections(model, alphas)
+    for expected, actual in zip(point_based_backup(model, alphas, beliefs),
+                                point_based_backup(model, alphas, beliefs, g)):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_lower_bound():
+    model = make_pomdp().compile()
+    assert lower_bound(model) == -1 / (1 - model.gamma)
+    model.rewards = np.full(model.n_states, 0.5)
+    assert lower_bound(model) == 0.5
+
+
+def test_point_based_value_iteration_on_compiled_model():
+    pomdp = make_pomdp()
+    expected = point_based_value_iteration(pomdp, n_beliefs=30, seed=1)
+    actual = point_based_value_iteration(pomdp.compile(), n_beliefs=30, seed=1)
+    np.testing.assert_array_equal(expected.alphas, actual.alphas)
+    np.testing.assert_array_equal(expected.actions, actual.actions)
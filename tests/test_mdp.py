@@ -0,0 +1,25 @@
+import numpy as np
+
+import mdp
+from grid_mdp import sequential_decision_environment
+
+
+def test_exact_policy_evaluation_solves_the_linear_system():
+    model = sequential_decision_environment.compile()
+    n = model.n_states
+    pi = np.random.default_rng(0).integers(len(model.actlist), size=n)
+    U = mdp._evaluate_policy(model, pi, np.zeros(n), exact=True)
+
+    T = np.zeros((n, n))
+    for s in range(n):
+        row = pi[s] * n + s
+        for k in range(model.indptr[row], model.indptr[row + 1]):
+            T[s, model.indices[k]] += model.data[k]
+    expected = np.linalg.solve(np.eye(n) - model.gamma * T, model.rewards)
+    np.testing.assert_allclose(U, expected, atol=1e-9)
+
+
+def test_exact_policy_iteration_agrees_with_value_iteration():
+    model = sequential_decision_environment.compile()
+    U = mdp.value_iteration_vectorized(model, 1e-6)
+    assert mdp.policy_iteration_vectorized(model, exact=True) == mdp.best_policy(sequential_decision_environment, U)
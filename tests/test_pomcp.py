@@ -0,0 +1,40 @@
+import contextlib
+import io
+
+from grid_pomdp import GridPOMDP
+from pomcp import POMCP
+
+
+def make_model():
+    r = -0.04
+    with contextlib.redirect_stdout(io.StringIO()):
+        pomdp = GridPOMDP([[r, r, r, +1],
+                           [r, None, r, -1],
+                           [r, r, r, r]],
+                          terminals=[(3, 2), (3, 1)], init=(0, 0))
+    return pomdp.compile()
+
+
+def test_search_keeps_only_completed_simulations():
+    model = make_model()
+    for seed in range(50):
+        planner = POMCP(model, n_particles=100, max_depth=500, seed=seed)
+        planner.search(time_budget=1e-5)
+        assert all(child.visits > 0 for child in planner.root.children.values())
+        action = planner.best_action()
+        assert action is None or planner.root.children[model.action_index[action]].visits > 0
+
+
+def test_best_action_without_simulations():
+    planner = POMCP(make_model(), n_particles=10, seed=0)
+    assert planner.best_action() is None
+
+
+def test_update_respects_sample_budget():
+    model = make_model()
+    planner = POMCP(model, n_particles=200, seed=0)
+    planner.search(time_budget=0.01)
+    action = planner.best_action()
+    planner.update(action, model.evidence_values[1], max_samples=50)
+    assert 0 < len(planner.root.particles) <= 200
+    assert all(model.sensor[1, s] > 0 for s in planner.root.particles)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from pomdp import prune_by_witness, prune_pointwise_dominated
+
+
+def dominated_brute_force(alphas):
+    """The indices kept by prune_pointwise_dominated, one pair at a time."""
+
+    keep = []
+    for i in range(len(alphas)):
+        dominated = False
+        for j in range(len(alphas)):
+            ge, gt = (alphas[j] >= alphas[i]).all(), (alphas[j] > alphas[i]).any()
+            if (ge and gt) or (ge and not gt and j < i):
+                dominated = True
+                break
+        if not dominated:
+            keep.append(i)
+    return keep
+
+
+@pytest.mark.parametrize('K, n', [(1, 3), (50, 4), (80, 2), (60, 30)])
+@pytest.mark.parametrize('max_elements', [1, 7, 100, 2 ** 22])
+def test_prune_pointwise_dominated(K, n, max_elements):
+    # small integer entries make ties and duplicates common
+    alphas = np.random.default_rng(K * n).integers(0, 3, (K, n)).astype(float)
+    assert prune_pointwise_dominated(alphas, max_elements).tolist() == dominated_brute_force(alphas)
+
+
+def test_prune_by_witness():
+    rng = np.random.default_rng(0)
+    alphas, beliefs = rng.random((20, 6)), rng.dirichlet(np.ones(6), 10)
+    witnesses = np.vstack([beliefs, np.eye(6)])
+    expected = np.unique(np.argmax(witnesses @ alphas.T, axis=1))
+    assert prune_by_witness(alphas, beliefs).tolist() == expected.tolist()
+
+
+def test_prune_by_witness_many_states():
+    # the certain beliefs are never built as an identity matrix
+    alphas = np.zeros((3, 200000))
+    alphas[1, 5] = 1.0
+    alphas[2, :] = -1.0
+    assert prune_by_witness(alphas, np.full((1, 200000), 1 / 200000)).tolist() == [0, 1]